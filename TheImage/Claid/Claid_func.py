@@ -1,6 +1,9 @@
 from typing import Optional, Dict, Any, List
+import json
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from .keys import Keys
 
 
@@ -11,13 +14,20 @@ def _clamp(v: float, lo: float, hi: float) -> float:
     return max(lo, min(hi, v))
 
 
+CONNECT_TIMEOUT = 10  # seconds
+
+# Shared, read-only payload fragments (never mutated; safe to reuse across calls)
+_CENTER_POSITION: Dict[str, float] = {"x": 0.5, "y": 0.5}
+_PNG_FORMAT: Dict[str, Any] = {"type": "png"}
+
+
 def _norm_position(pos: Optional[Dict[str, float]]) -> Dict[str, float]:
     """
     Normalize and clamp position dict to [0..1].
     Defaults to the image center if missing.
     """
     if not isinstance(pos, dict):
-        return {"x": 0.5, "y": 0.5}
+        return _CENTER_POSITION
     x = _clamp(float(pos.get("x", 0.5)), 0.0, 1.0)
     y = _clamp(float(pos.get("y", 0.5)), 0.0, 1.0)
     return {"x": x, "y": y}
@@ -37,18 +47,12 @@ def _collect_tmp_urls(data: Dict[str, Any]) -> List[str]:
     """
     Normalize Claid response into data['tmp_urls']: List[str]
     """
-    urls: List[str] = []
     out = (data or {}).get("output")
-    if isinstance(out, dict):
-        tu = out.get("tmp_url")
-        if isinstance(tu, str) and tu:
-            urls.append(tu)
-    elif isinstance(out, list):
-        for o in out:
-            if isinstance(o, dict):
-                tu = o.get("tmp_url")
-                if isinstance(tu, str) and tu:
-                    urls.append(tu)
+    items = out if isinstance(out, list) else [out] if isinstance(out, dict) else []
+    urls: List[str] = [
+        tu for o in items if isinstance(o, dict)
+        for tu in (o.get("tmp_url"),) if isinstance(tu, str) and tu
+    ]
     data["tmp_urls"] = urls
     return urls
 
@@ -68,6 +72,9 @@ class ClaidFunc:
     - Strong decompression; PNG output for transparency
     """
 
+    # Default restorations block (read-only; shared across calls)
+    _RESTORATIONS_STRONG: Dict[str, Any] = {"decompress": "strong", "polish": False}
+
     def __init__(self, api_key: Optional[str] = None, timeout: int = 60):
         self.api_key = api_key or Keys.get_claid_api_key()
         self.base_url = "https://api.claid.ai"
@@ -77,7 +84,24 @@ class ClaidFunc:
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
             "Accept": "*/*",
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
         })
+        # Larger keep-alive pool so batch/concurrent calls reuse TLS connections.
+        # This is the only retry layer for Claid calls. /image/edit and /scene/create are
+        # paid, non-idempotent POSTs, so only failures where Claid did not run the request
+        # are retried: connection errors (nothing sent) and 429 (rejected before processing).
+        # Read errors / 5xx are not resent; the final response still reaches _post.
+        retry = Retry(
+            total=3,
+            read=0,
+            backoff_factor=0.3,
+            status_forcelist=(429,),
+            allowed_methods=frozenset({"POST"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retry)
+        self.session.mount("https://", adapter)
 
         # Global defaults (override via env without editing code)
         #   THEE_ABG_DEFAULT_SCALE -> default scale for add_background
@@ -87,6 +111,48 @@ class ClaidFunc:
             "THEE_ABG_NEGATIVE",
             "text, logo, watermark, hands, reflections, low quality, artifacts, extra objects"
         )
+        # Scene fields that only change when a caller overrides the defaults
+        self._scene_base: Dict[str, Any] = {
+            "model": "v2",
+            "negative_prompt": self._default_negative,
+            "preference": "optimal",
+        }
+
+    # ---------------------------
+    # Lifecycle
+    # ---------------------------
+    def close(self) -> None:
+        """Release pooled HTTP connections."""
+        self.session.close()
+
+    def __enter__(self) -> "ClaidFunc":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    # ---------------------------
+    # HTTP
+    # ---------------------------
+    def _post(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        POST a JSON payload and return the parsed response body.
+        The body is read and parsed once; the same parse serves the error path.
+        """
+        # kısa connect timeout: erişilemeyen uç hemen düşer; read timeout üretim süresine göre uzun kalır
+        resp = self.session.post(url, json=payload, timeout=(CONNECT_TIMEOUT, self.timeout))
+        raw = resp.content
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            body = None
+
+        if resp.status_code >= 400:
+            err = body if body is not None else {"error_message": resp.text}
+            raise RuntimeError(f"Claid error {resp.status_code}: {err}")
+        if not isinstance(body, dict):
+            raise RuntimeError(f"Claid returned a non-JSON response ({resp.status_code}): {resp.text[:200]}")
+        return body
 
     # ---------------------------
     # BACKGROUND REMOVAL (URL)
@@ -112,16 +178,23 @@ class ClaidFunc:
             raise ValueError("Transparent background requires png/webp/avif output.")
 
         url = f"{self.base_url}/v1/image/edit"
+        if decompress == "strong" and not polish:
+            restorations = self._RESTORATIONS_STRONG
+        else:
+            restorations = {"decompress": decompress, "polish": polish}
         operations: Dict[str, Any] = {
-            "restorations": {"decompress": decompress, "polish": polish},
+            "restorations": restorations,
             "background": {
                 "remove": {"category": category, "clipping": clipping},
                 "color": color,
             },
         }
-        fmt: Dict[str, Any] = {"type": output_type}
-        if output_type == "jpeg":
-            fmt.update({"quality": jpeg_quality, "progressive": progressive})
+        if output_type == "png":
+            fmt: Dict[str, Any] = _PNG_FORMAT
+        elif output_type == "jpeg":
+            fmt = {"type": output_type, "quality": jpeg_quality, "progressive": progressive}
+        else:
+            fmt = {"type": output_type}
 
         payload: Dict[str, Any] = {
             "input": input_url,
@@ -129,15 +202,8 @@ class ClaidFunc:
             "output": {"format": fmt},
         }
 
-        resp = self.session.post(url, json=payload, timeout=self.timeout)
-        if resp.status_code >= 400:
-            try:
-                err = resp.json()
-            except Exception:
-                err = {"error_message": resp.text}
-            raise RuntimeError(f"Claid error {resp.status_code}: {err}")
-
-        return resp.json().get("data", {})
+        body = self._post(url, payload)
+        return body.get("data", {})
 
     # ---------------------------
     # AI BACKGROUND (GENERIC)
@@ -190,7 +256,6 @@ class ClaidFunc:
         # Safe defaults for framing
         scale_val = _norm_scale(scale, self._default_scale)
         pos_val = _norm_position(position)
-        neg = negative_prompt or self._default_negative
 
         # Build prompt section
         if use_autoprompt:
@@ -208,13 +273,7 @@ class ClaidFunc:
                 "scale": scale_val,
                 "position": pos_val,
             },
-            "scene": {
-                "model": model,
-                "prompt": prompt_block,
-                "negative_prompt": neg,
-                "aspect_ratio": aspect_ratio,
-                "preference": preference,
-            },
+            "scene": self._scene(prompt_block, aspect_ratio, model, preference, negative_prompt),
             "output": {
                 "number_of_images": number_of_images,
                 "format": output_format,
@@ -222,18 +281,29 @@ class ClaidFunc:
         }
 
         url = f"{self.base_url}/v1/scene/create"
-        resp = self.session.post(url, json=payload, timeout=self.timeout)
-        if resp.status_code >= 400:
-            try:
-                err = resp.json()
-            except Exception:
-                err = {"error_message": resp.text}
-            raise RuntimeError(f"Claid error {resp.status_code}: {err}")
-
-        data = resp.json().get("data", {}) or {}
+        body = self._post(url, payload)
+        data = body.get("data", {}) or {}
         _collect_tmp_urls(data)
         return data
 
+    def _scene(
+        self,
+        prompt_block: Any,
+        aspect_ratio: str,
+        model: str,
+        preference: str,
+        negative_prompt: Optional[str],
+    ) -> Dict[str, Any]:
+        """Per-call scene block: shared defaults + prompt/aspect (+ any overrides)."""
+        scene = {**self._scene_base, "prompt": prompt_block, "aspect_ratio": aspect_ratio}
+        if model != scene["model"]:
+            scene["model"] = model
+        if preference != scene["preference"]:
+            scene["preference"] = preference
+        if negative_prompt:
+            scene["negative_prompt"] = negative_prompt
+        return scene
+
 
 def _sanity_check():
     f = ClaidFunc()
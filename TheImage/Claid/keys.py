@@ -1,11 +1,25 @@
 # CLAID/keys.py
 from __future__ import annotations
 import os, json, pathlib
+from functools import lru_cache
 from typing import Optional
 
 # CLAID klasörü içinde secrets dosyası için yol
 _SECRETS_FILE = pathlib.Path(__file__).with_name("claid.secrets.json")
 
+
+@lru_cache(maxsize=1)
+def _load_file_key() -> str:
+    # secrets dosyası süreç başına bir kez okunur; save_claid_api_key cache'i temizler
+    if _SECRETS_FILE.exists():
+        try:
+            data = json.loads(_SECRETS_FILE.read_text())
+            return (data.get("CLAID_API_KEY") or "").strip()
+        except Exception:
+            pass
+    return ""
+
+
 class Keys:
 
 
@@ -15,14 +29,9 @@ class Keys:
         if key and key.strip():
             return key.strip()
 
-        if _SECRETS_FILE.exists():
-            try:
-                data = json.loads(_SECRETS_FILE.read_text())
-                key = (data.get("CLAID_API_KEY") or "").strip()
-                if key:
-                    return key
-            except Exception:
-                pass
+        key = _load_file_key()
+        if key:
+            return key
 
         raise RuntimeError(
             "CLAID_API_KEY not found. "
@@ -35,6 +44,7 @@ class Keys:
         if not value:
             raise ValueError("Empty API key.")
         _SECRETS_FILE.write_text(json.dumps({"CLAID_API_KEY": value}, indent=2))
+        _load_file_key.cache_clear()
         try:
             os.chmod(_SECRETS_FILE, 0o600)  # Unix sistemlerde sadece sahip okuyabilsin
         except Exception:
@@ -1,12 +1,13 @@
 # TheImage/pubimg/edit_image.py
 from __future__ import annotations
 
+import io
 import os
 from dataclasses import dataclass, asdict
 from pathlib import Path
 from typing import Optional, Tuple, Dict, Any
 
-from PIL import Image, ImageFilter, ImageEnhance
+from PIL import Image, ImageFilter, ImageEnhance, ImageStat
 
 
 # ----------- Varsayılanlar -----------
@@ -16,6 +17,13 @@ MAX_LONG_EDGE = int(os.getenv("THEE_PREP_MAX_LONG", "3200"))   # max uzun kenar
 TARGET_LONG_EDGE = int(os.getenv("THEE_PREP_TARGET_LONG", "2200"))  # ideal uzun kenar hedefi
 MIN_FILESIZE_KB_OK = int(os.getenv("THEE_PREP_MIN_KB", "140")) # düşük kalite eşiği (was 120)
 DEFAULT_JPEG_QUALITY = int(os.getenv("THEE_PREP_JPEG_Q", "94")) # was 92
+# optimize=True ikinci bir Huffman geçişi yapar (~%5-10 küçük dosya, daha yavaş encode)
+JPEG_OPTIMIZE = os.getenv("THEE_PREP_JPEG_OPTIMIZE", "1") != "0"
+# resize(reducing_gap=...) — 3.0 ≈ saf LANCZOS kalitesi; küçüldükçe daha hızlı
+RESIZE_REDUCING_GAP = float(os.getenv("THEE_PREP_REDUCING_GAP", "3.0"))
+# Prep algoritmasının sürümü; çıktı byte'larını değiştiren her kod değişikliğinde artırın
+# (draft decode, tek geçişli upscale, kontrast LUT, ...) → kalıcı prep cache'i geçersizleşir
+PREP_VERSION = 3  # 3: prepped dosya adı cache anahtarı hash'ini taşır
 
 # Çıktı nereye?
 ROOT = Path(__file__).resolve().parents[2]  # .../The E
@@ -50,7 +58,7 @@ class ImagePrep:
     """
     Claid'e gitmeden önce görseli toparlar:
     - Analiz
-    - Min/max/target uzun kenara göre yeniden boyutlandırma (LANCZOS, çok-kademeli upscale)
+    - Min/max/target uzun kenara göre yeniden boyutlandırma (tek geçişli LANCZOS)
     - Hafif denoise + unsharp mask
     - Şeffaflık yoksa JPEG'e çevirme (quality varsayılan 94, optimize)
     - TheProd/prep/ içine kaydetme
@@ -64,6 +72,7 @@ class ImagePrep:
         min_filesize_kb_ok: int = MIN_FILESIZE_KB_OK,
         out_dir: Path = DEFAULT_OUTDIR,
         jpeg_quality: int = DEFAULT_JPEG_QUALITY,
+        jpeg_optimize: bool = JPEG_OPTIMIZE,
     ):
         self.min_long = int(min_long_edge)
         self.max_long = int(max_long_edge)
@@ -72,50 +81,59 @@ class ImagePrep:
         self.out_dir = Path(out_dir)
         self.out_dir.mkdir(parents=True, exist_ok=True)
         self.jpeg_quality = int(jpeg_quality)
+        self.jpeg_optimize = bool(jpeg_optimize)
 
     # ---------- Public API ----------
 
     def _resize_lanczos(self, img: Image.Image, new_size: tuple[int, int]) -> Image.Image:
-        # Single place to call LANCZOS to keep pillow import usage consistent
-        return img.resize(new_size, Image.Resampling.LANCZOS)
+        # Single place to call LANCZOS to keep pillow import usage consistent.
+        # reducing_gap: büyük küçültmelerde önce C tarafında tamsayı box-reduce(),
+        # sonra kısa LANCZOS; sonuç görsel olarak aynı, çok daha hızlı (büyütmede etkisiz).
+        return img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=RESIZE_REDUCING_GAP)
 
-    def prepare(self, image_path: str | Path) -> Tuple[str, PrepReport]:
+    def prepare(self, image_path: str | Path, tag: Optional[str] = None) -> Tuple[str, PrepReport]:
         """
         Görseli hazırlar ve (new_path, report) döner.
         new_path, Claid'e/ S3'e gönderilecek dosyadır.
         """
+        buf, report = self.prepare_to_buffer(image_path, tag=tag)
+        Path(report.output_path).write_bytes(buf.getbuffer())
+        return report.output_path, report
+
+    def prepare_to_buffer(self, image_path: str | Path, tag: Optional[str] = None) -> Tuple[io.BytesIO, PrepReport]:
+        """
+        prepare() ile aynı işlem, ama sonucu diske yazmadan (BytesIO, report) döner.
+        Buffer başa sarılmış gelir; doğrudan S3'e stream edilebilir.
+        report.output_path, prepare()'in yazacağı yoldur: <stem>__prep.<ext>, `tag` verilirse
+        <stem>__<tag>__prep.<ext> (ör. içerik hash'i → aynı adlı farklı kaynaklar çakışmaz).
+        """
         src = Path(image_path).expanduser().resolve()
         if not src.exists():
             raise FileNotFoundError(src)
 
-        # 1) Analiz
-        meta = self._analyze(src)
-
-        # 2) Görseli yükle
+        # 1-2) Tek açılış: header'dan analiz, ardından aynı handle ile yükle
         img = Image.open(src)
+        meta = self._analyze(src, img)
+        w, h = meta["width"], meta["height"]
+        long_edge = meta["long_edge"]
+        if long_edge > self.max_long and (img.format or "").upper() == "JPEG":
+            # libjpeg'e DCT seviyesinde 1/2, 1/4, 1/8 ölçekli decode yaptır;
+            # sonuç hedef boyuttan küçük olmaz, son LANCZOS tam boyuta oturtur.
+            s = self.max_long / long_edge
+            img.draft("RGB", (int(w * s), int(h * s)))
         img.load()  # lazy load'ı tamamla
 
-        # 3) Boyutlandırma kararı (iterative upscale to target)
-        w, h = img.size
-        long_edge = max(w, h)
+        # 3) Boyutlandırma kararı (single-pass resize to target)
         upscaled = downscaled = False
 
         # hedef: en az min_long, ideal olarak target_long; üst sınır max_long
         target = max(self.min_long, self.target_long)
 
         if long_edge < target:
-            # Çok küçük görseller için 1.4x adımlarla yumuşak yükseltme,
-            # sonra tam hedefe "snap".
-            curr_w, curr_h = w, h
-            while max(curr_w, curr_h) * 1.4 < target:
-                curr_w = int(curr_w * 1.4)
-                curr_h = int(curr_h * 1.4)
-                img = self._resize_lanczos(img, (curr_w, curr_h))
-                # küçük bir median filtre upscale adım sonrası artefaktları alır
-                img = img.filter(ImageFilter.MedianFilter(size=3))
-            # son hassas adım: tam hedefe oturt
-            scale = target / max(img.size)
-            new_size = (int(img.size[0] * scale), int(img.size[1] * scale))
+            # Tek LANCZOS geçişiyle doğrudan hedefe; ara kademeler yok.
+            # Upscale artefaktlarını 4. adımdaki tek median filtre alır.
+            scale = target / long_edge
+            new_size = (int(w * scale), int(h * scale))
             img = self._resize_lanczos(img, new_size)
             upscaled = True
 
@@ -142,24 +160,27 @@ class ImagePrep:
 
         # 6) Biraz contrast/clarity (çok hafif, yapay görünmesin)
         if not has_alpha:
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.05)  # +5% micro-contrast
+            img = img.convert("RGB")  # JPEG'e zaten RGB gidiyor; LUT 8-bit kanal ister
+            img = self._contrast_lut(img, 1.05)  # +5% micro-contrast
             enhancer = ImageEnhance.Sharpness(img)
             img = enhancer.enhance(1.06)  # +6% clarity
 
         # 7) Kaydet
-        out_name = src.stem + "__prep" + out_ext
+        out_name = f"{src.stem}__{tag}__prep{out_ext}" if tag else src.stem + "__prep" + out_ext
         out_path = (self.out_dir / out_name).resolve()
 
         save_kwargs: Dict[str, Any] = {}
         if out_format == "JPEG":
             img = img.convert("RGB")  # güvenli
-            save_kwargs.update(dict(quality=self.jpeg_quality, optimize=True))
+            save_kwargs.update(dict(quality=self.jpeg_quality, optimize=self.jpeg_optimize))
         else:
             # PNG tarafında optimize otomatik/ sınırlı
             save_kwargs.update(dict(optimize=True))
 
-        img.save(out_path, out_format, **save_kwargs)
+        buf = io.BytesIO()
+        img.save(buf, out_format, **save_kwargs)
+        size = buf.tell()
+        buf.seek(0)
 
         # 8) Rapor
         out_w, out_h = img.size
@@ -173,7 +194,7 @@ class ImagePrep:
             width_out=out_w,
             height_out=out_h,
             file_kb_in=meta["file_kb"],
-            file_kb_out=self._filesize_kb(out_path),
+            file_kb_out=max(1, int(round(size / 1024))),
             upscaled=upscaled,
             downscaled=downscaled,
             sharpened=sharpened,
@@ -182,15 +203,18 @@ class ImagePrep:
             notes=self._note(meta),
         )
 
-        return str(out_path), report
+        return buf, report
 
     # ---------- Helpers ----------
 
-    def _analyze(self, p: Path) -> Dict[str, Any]:
-        with Image.open(p) as im:
-            w, h = im.size
-            fmt = (im.format or "").upper()
-            has_alpha = self._has_alpha(im)
+    def _analyze(self, p: Path, im: Optional[Image.Image] = None) -> Dict[str, Any]:
+        """Header bilgileri; açık bir handle verilirse dosya tekrar açılmaz."""
+        if im is None:
+            with Image.open(p) as probe:
+                return self._analyze(p, probe)
+        w, h = im.size
+        fmt = (im.format or "").upper()
+        has_alpha = self._has_alpha(im)
         return {
             "path": str(p),
             "width": w,
@@ -201,6 +225,17 @@ class ImagePrep:
             "has_alpha": has_alpha,
         }
 
+    @staticmethod
+    def _contrast_lut(img: Image.Image, factor: float) -> Image.Image:
+        """
+        ImageEnhance.Contrast gibi gri ortalama etrafında ölçekler, ama degenerate görüntü + blend
+        yerine tek bir point() LUT geçişiyle. Birebir aynı değil: LUT yuvarlar (+0.5), Pillow'un
+        blend'i keser; kanal değerleri ±1 seviye farklı çıkabilir.
+        """
+        mean = int(ImageStat.Stat(img.convert("L")).mean[0] + 0.5)
+        table = [max(0, min(255, int(mean + factor * (i - mean) + 0.5))) for i in range(256)]
+        return img.point(table * len(img.getbands()))
+
     @staticmethod
     def _filesize_kb(p: Path) -> int:
         try:
@@ -1,35 +1,148 @@
 # pubimg/link_store.py
+import hashlib
 import json
 import os
-from typing import Dict, Optional
+import threading
+from typing import Any, Dict, Optional
+
+try:  # opsiyonel: orjson ile index serileştirme çok daha hızlı
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _blake2b_128():
+    return hashlib.blake2b(digest_size=16)
+
+
+def hash_file(path: str) -> str:
+    """
+    İçerik hash'i (BLAKE2b-128). Python 3.11+'da hashlib.file_digest okuma
+    döngüsünü C tarafında, tekrar kullanılan bir buffer ile yapar.
+    """
+    with open(path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, _blake2b_128).hexdigest()
+        h = _blake2b_128()
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+        return h.hexdigest()
+
 
 class LinkStore:
     """
-    index.json içinde: { file_hash: { "path": <str>, "url": <str> } }
+    index.json içinde: { file_hash: { "path": <str>, "url": <str>, ...extra } }
+
+    `with store:` bloğu içinde set() diske yazmaz; blok bitince tek seferde kaydedilir.
+    Yazma işlemleri kilitli; aynı store birden çok thread'den güvenle kullanılabilir.
+
+    Yan index (<index>.paths.json): { abs_path: { "size", "mtime_ns", "digest" } } —
+    boyutu/mtime'ı değişmemiş dosyalar tekrar hash'lenmez (bkz. cached_digest).
+    Yalnızca cached_digest/remember_digest ilk çağrıldığında yüklenir.
     """
     def __init__(self, index_path: str):
         self.index_path = index_path
-        self._data: Dict[str, Dict[str, str]] = {}
+        self.paths_path = os.path.splitext(index_path)[0] + ".paths.json"
+        self._data: Dict[str, Dict[str, Any]] = {}
+        self._by_path: Optional[Dict[str, Dict[str, Any]]] = None  # lazy
+        self._paths_dirty = False
+        self._batch_depth = 0
+        self._dirty = False
+        self._lock = threading.RLock()
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
         self.load()
 
-    def load(self) -> None:
+    def __enter__(self) -> "LinkStore":
+        with self._lock:
+            self._batch_depth += 1
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        with self._lock:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.flush()
+
+    @staticmethod
+    def _read(path: str) -> Dict[str, Any]:
         try:
-            with open(self.index_path, "r", encoding="utf-8") as f:
-                self._data = json.load(f)
+            with open(path, "rb") as f:
+                raw = f.read()
         except FileNotFoundError:
-            self._data = {}
+            return {}
+        return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+    @staticmethod
+    def _write(path: str, data: Dict[str, Any]) -> None:
+        if orjson is not None:
+            blob = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+        else:
+            blob = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+
+    def load(self) -> None:
+        self._data = self._read(self.index_path)
+        self._by_path = None
 
     def save(self) -> None:
-        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
-        tmp = self.index_path + ".tmp"
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(self._data, f, ensure_ascii=False, indent=2)
-        os.replace(tmp, self.index_path)
+        """index.json'ı hemen yazar (yan index değiştiyse o da yazılır)."""
+        with self._lock:
+            self._write(self.index_path, self._data)
+            self._dirty = False
+            self._save_paths()
+
+    def _save_paths(self) -> None:
+        with self._lock:
+            if self._paths_dirty:
+                self._write(self.paths_path, self._by_path)
+                self._paths_dirty = False
+
+    def flush(self) -> None:
+        """Yalnızca değişen dosyaları yazar."""
+        with self._lock:
+            if self._dirty:
+                self.save()
+            else:
+                self._save_paths()
+
+    def _touch(self) -> None:
+        self._dirty = True
+        if not self._batch_depth:
+            self.save()
+
+    def _paths(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            if self._by_path is None:
+                self._by_path = self._read(self.paths_path)
+            return self._by_path
+
+    def cached_digest(self, path: str, st: os.stat_result) -> Optional[str]:
+        """Dosya son hash'lendiğinden beri boyut/mtime aynıysa eski digest; değilse None."""
+        row = self._paths().get(path)
+        if row and row["size"] == st.st_size and row["mtime_ns"] == st.st_mtime_ns:
+            return row["digest"]
+        return None
+
+    def remember_digest(self, path: str, st: os.stat_result, digest: str) -> None:
+        with self._lock:
+            self._paths()[path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "digest": digest}
+            self._paths_dirty = True
+            if not self._batch_depth:
+                self._save_paths()
 
     def get(self, file_hash: str) -> Optional[str]:
         row = self._data.get(file_hash)
         return row["url"] if row else None
 
-    def set(self, file_hash: str, path: str, url: str) -> None:
-        self._data[file_hash] = {"path": path, "url": url}
-        self.save()
\ No newline at end of file
+    def get_row(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        return self._data.get(file_hash)
+
+    def set(self, file_hash: str, path: str, url: str, **extra: Any) -> None:
+        with self._lock:
+            self._data[file_hash] = {"path": path, "url": url, **extra}
+            self._touch()
@@ -1,8 +1,11 @@
 # pubimg/make_links.py
 import os
+import ssl
 import hashlib
-from typing import List
-from pubimg.s3_uploader import S3Uploader
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List
+from boto3.s3.transfer import TransferConfig
+from pubimg.s3_uploader import MB, S3Uploader
 from pubimg.link_store import LinkStore
 
 # ✏️ Burayı sadece gerekirse değiştir
@@ -11,32 +14,46 @@ REGION  = os.environ.get("THE_E_AWS_REGION", "eu-north-1")
 IMAGES_DIR = os.path.join(os.path.dirname(__file__), "images")
 INDEX_PATH = os.path.join(os.path.dirname(__file__), "index.json")
 
-ALLOWED_EXTS = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp", ".tiff"}
+ALLOWED_EXTS = (".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp", ".tiff")  # str.endswith için tuple
+
+# hash CPU'da (GIL bırakılır), upload ağda; ikisi de thread havuzunda
+HASH_WORKERS = int(os.environ.get("THEE_HASH_WORKERS", str(os.cpu_count() or 4)))
+UPLOAD_WORKERS = int(os.environ.get("THEE_UPLOAD_WORKERS", "16"))
+# dosya içi paralellik (multipart parçaları); dosyalar arası paralellik UPLOAD_WORKERS'ta
+PART_CONCURRENCY = int(os.environ.get("THEE_UPLOAD_PART_CONCURRENCY", "4"))
+
+def _sha256():
+    # usedforsecurity=False: FIPS sarmalayıcısı atlanır, OpenSSL en hızlı yolu (SHA-NI) seçer
+    return hashlib.sha256(usedforsecurity=False)
 
 def sha256_file(path: str) -> str:
-    h = hashlib.sha256()
+    # index.json anahtarları SHA-256; 3.11+'da okuma+update döngüsü C tarafında (GIL bırakılır)
     with open(path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, _sha256).hexdigest()
+        h = _sha256()
         for chunk in iter(lambda: f.read(1024 * 1024), b""):
             h.update(chunk)
-    return h.hexdigest()
+        return h.hexdigest()
 
 def scan_images(root: str) -> List[str]:
     if not os.path.isdir(root):
         print(f"⚠️  images klasörü yok: {root}")
         return []
     files = []
-    for name in os.listdir(root):
-        p = os.path.join(root, name)
-        if not os.path.isfile(p):
-            continue
-        ext = os.path.splitext(name)[1].lower()
-        if ext in ALLOWED_EXTS:
-            files.append(p)
-        else:
-            print(f"↩️  Atlandı (uzantı desteklenmiyor): {name}")
+    with os.scandir(root) as it:  # is_file DirEntry'den (ayrı stat yok)
+        for e in it:
+            if not e.is_file():
+                continue
+            if e.name.lower().endswith(ALLOWED_EXTS):
+                files.append(e.path)
+            else:
+                print(f"↩️  Atlandı (uzantı desteklenmiyor): {e.name}")
     return sorted(files)
 
 def main() -> None:
+    # SHA-NI hızlandırması OpenSSL'e bağlı (1.1.1+); hangi sürümle çalıştığımız görünsün
+    print(f"🔐 sha256 via {ssl.OPENSSL_VERSION}")
     print(f"🔎 Scanning: {IMAGES_DIR}")
     paths = scan_images(IMAGES_DIR)
     if not paths:
@@ -45,22 +62,48 @@ def main() -> None:
 
     store = LinkStore(INDEX_PATH)
     uploader = S3Uploader(bucket_name=BUCKET, region=REGION)
+    tcfg = TransferConfig(
+        multipart_threshold=8 * MB,
+        multipart_chunksize=8 * MB,
+        max_concurrency=PART_CONCURRENCY,
+        use_threads=True,
+    )
 
-    uploaded_any = False
-    for p in paths:
-        digest = sha256_file(p)
+    # 1) Hash'ler paralel; boyutu/mtime'ı değişmemiş dosyalar yan index'ten (hash yok)
+    def _digest(p: str) -> str:
+        st = os.stat(p)
+        digest = store.cached_digest(p, st)
+        if digest is None:
+            digest = sha256_file(p)
+            store.remember_digest(p, st, digest)
+        return digest
+
+    with store, ThreadPoolExecutor(max_workers=max(1, min(HASH_WORKERS, len(paths)))) as pool:
+        digests = list(pool.map(_digest, paths))
+
+    # 2) Index'te olmayanlar (aynı içerikli iki dosya → tek upload)
+    to_upload: Dict[str, str] = {}
+    for p, digest in zip(paths, digests):
         existing = store.get(digest)
         if existing:
             print(f"✅ ZATEN VAR: {os.path.basename(p)} → {existing}")
-            continue
+        elif digest not in to_upload:
+            to_upload[digest] = p
 
-        try:
-            url = uploader.upload_file(p)
-            store.set(digest, p, url)
-            print(f"🟢 KAYDEDİLDİ: {os.path.basename(p)} → {url}")
-            uploaded_any = True
-        except Exception as e:
-            print(f"🔴 HATA: {os.path.basename(p)} → {e}")
+    # 3) Upload'lar paralel; index sonuçlar geldikçe ana thread'den güncellenir
+    uploaded_any = False
+    if to_upload:
+        with store, ThreadPoolExecutor(max_workers=max(1, min(UPLOAD_WORKERS, len(to_upload)))) as pool:
+            futs = {pool.submit(uploader.upload_file, p, tcfg): (digest, p) for digest, p in to_upload.items()}
+            for fut in as_completed(futs):  # index.json blok sonunda tek sefer yazılır
+                digest, p = futs[fut]
+                try:
+                    url = fut.result()
+                    store.set(digest, p, url)
+                    print(f"🟢 KAYDEDİLDİ: {os.path.basename(p)} → {url}")
+                    uploaded_any = True
+                except Exception as e:
+                    print(f"🔴 HATA: {os.path.basename(p)} → {e}")
 
     if not uploaded_any:
         print("ℹ️  Hepsi daha önce yüklenmişti (index.json’dan bulundu).")
@@ -1,36 +1,142 @@
 # pubimg/s3_uploader.py
 import os
+import hashlib
 import mimetypes
 import boto3
-from datetime import datetime
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from datetime import datetime, timezone
+from typing import BinaryIO, Dict, Optional
+
+from .link_store import LinkStore
+
+MB = 1024 * 1024
+# multipart ayarları (env ile değiştirilebilir); çok büyük görsellerde parça boyunu 32-50 MB'a çekin
+# eşik altı dosyalar tek PutObject ile gider (Create/Complete multipart turları olmadan)
+MULTIPART_THRESHOLD_MB = int(os.getenv("THEE_S3_MULTIPART_THRESHOLD_MB", "8"))
+MULTIPART_CHUNK_MB = int(os.getenv("THEE_S3_MULTIPART_CHUNK_MB", "16"))
+MAX_CONCURRENCY = int(os.getenv("THEE_S3_MAX_CONCURRENCY", "8"))
+
+
+def _stream_digest(fileobj: BinaryIO) -> str:
+    """BLAKE2b-128 of a rewound stream (BytesIO is hashed whole); position is restored."""
+    pos = fileobj.tell()
+    if hasattr(hashlib, "file_digest"):  # BytesIO → hashes getbuffer() directly, no copy
+        digest = hashlib.file_digest(fileobj, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+    else:
+        h = hashlib.blake2b(digest_size=16)
+        for chunk in iter(lambda: fileobj.read(1024 * 1024), b""):
+            h.update(chunk)
+        digest = h.hexdigest()
+    fileobj.seek(pos)
+    return digest
 
 class S3Uploader:
-    def __init__(self, bucket_name: str, region: str = "eu-north-1"):
+    def __init__(self, bucket_name: str, region: str = "eu-north-1", known_index: Optional[str] = None):
         self.bucket = bucket_name
         self.region = region
-        self.s3 = boto3.client("s3", region_name=region)
+        # boto3 client'ları thread-safe; paralel upload'lar için havuzu büyütüyoruz
+        cfg = Config(
+            max_pool_connections=32,
+            retries={"max_attempts": 5, "mode": "adaptive"},
+        )
+        self.s3 = boto3.client("s3", region_name=region, config=cfg)
+        # eşik üstü dosyalar multipart + paralel parça PUT, altındakiler tek PUT ile gider
+        self._threshold = MULTIPART_THRESHOLD_MB * MB
+        self._tcfg = TransferConfig(
+            multipart_threshold=self._threshold,
+            multipart_chunksize=MULTIPART_CHUNK_MB * MB,
+            max_concurrency=MAX_CONCURRENCY,
+            use_threads=True,
+        )
+        # content key → URL for objects known to exist (this process)
+        self._known: Dict[str, str] = {}
+        # opsiyonel kalıcı index: sonraki çalıştırmalarda HEAD isteği de atlanır
+        self._known_store = LinkStore(known_index) if known_index else None
 
     def _guess_content_type(self, file_path: str) -> str:
         ctype, _ = mimetypes.guess_type(file_path)
         return ctype or "application/octet-stream"
 
-    def upload_file(self, file_path: str) -> str:
-        base = os.path.basename(file_path)
+    def _key_for(self, filename: str) -> str:
         # tarih bazlı key (boşlukları dash yapalım)
-        slug = base.replace(" ", "-")
-        today = datetime.utcnow().strftime("%Y/%m/%d")
-        key = f"uploads/{today}/{slug}"
+        slug = os.path.basename(filename).replace(" ", "-")
+        today = datetime.now(timezone.utc).strftime("%Y/%m/%d")
+        return f"uploads/{today}/{slug}"
+
+    def _url_for(self, key: str) -> str:
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{key}"
 
+    def upload_file(self, file_path: str, config: Optional[TransferConfig] = None) -> str:
+        """`config` verilirse (ör. çağıranın paralellik bütçesine göre) varsayılan TransferConfig yerine o kullanılır."""
+        key = self._key_for(file_path)
         ctype = self._guess_content_type(file_path)
+        tcfg = config or self._tcfg
 
         print(f"⬆️  Uploading: {file_path}  →  s3://{self.bucket}/{key}  ({ctype})")
-        self.s3.upload_file(
-            file_path,
-            self.bucket,
-            key,
-            ExtraArgs={"ContentType": ctype}
-        )
+        if os.path.getsize(file_path) < tcfg.multipart_threshold:
+            with open(file_path, "rb") as f:
+                self.s3.put_object(Bucket=self.bucket, Key=key, Body=f, ContentType=ctype)
+        else:
+            self.s3.upload_file(
+                file_path,
+                self.bucket,
+                key,
+                ExtraArgs={"ContentType": ctype},
+                Config=tcfg,
+            )
+
+        url = self._url_for(key)
+        print(f"✅ Uploaded URL: {url}")
+        return url
 
-        url = f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{key}"
+    def upload_fileobj(self, fileobj: BinaryIO, filename: str, key: Optional[str] = None) -> str:
+        """Bellekteki (ya da açık) bir dosyayı diske yazmadan yükler; key/content-type `filename`'den."""
+        key = key or self._key_for(filename)
+        ctype = self._guess_content_type(filename)
+
+        print(f"⬆️  Uploading: <stream> {os.path.basename(filename)}  →  s3://{self.bucket}/{key}  ({ctype})")
+        pos = fileobj.tell()
+        size = fileobj.seek(0, os.SEEK_END) - pos
+        fileobj.seek(pos)
+        if size < self._threshold:
+            self.s3.put_object(Bucket=self.bucket, Key=key, Body=fileobj, ContentType=ctype)
+        else:
+            self.s3.upload_fileobj(
+                fileobj,
+                self.bucket,
+                key,
+                ExtraArgs={"ContentType": ctype},
+                Config=self._tcfg,
+            )
+
+        url = self._url_for(key)
         print(f"✅ Uploaded URL: {url}")
-        return url
\ No newline at end of file
+        return url
+
+    def upload_fileobj_dedup(self, fileobj: BinaryIO, filename: str) -> str:
+        """
+        İçerik hash'ini key yapar (prepped/<blake2b><ext>); obje S3'te zaten varsa
+        yüklemeden URL döner. Aynı içerik → aynı URL (tekrar çalıştırmalarda PUT yok).
+        """
+        ext = os.path.splitext(filename)[1].lower()
+        key = f"prepped/{_stream_digest(fileobj)}{ext}"
+        if key in self._known:
+            return self._known[key]
+        stored = self._known_store.get(key) if self._known_store else None
+        if stored:
+            self._known[key] = stored
+            return stored
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=key)
+            url = self._url_for(key)
+            print(f"♻️  Already on S3: {url}")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+                raise
+            url = self.upload_fileobj(fileobj, filename, key=key)
+        self._known[key] = url
+        if self._known_store:
+            self._known_store.set(key, filename, url)
+        return url
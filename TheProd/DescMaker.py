@@ -1,18 +1,38 @@
 # TheProd/DescMaker.py
 from __future__ import annotations
 
+import hashlib
+import io
 import json
 import os
 import pathlib
 import re
 import mimetypes
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Any, Dict, List, Optional
 
+from PIL import Image
 from google.cloud import aiplatform
 from vertexai.generative_models import GenerativeModel, Part, SafetySetting, HarmCategory
 
+try:  # opsiyonel: orjson varsa JSON parse/serialize çok daha hızlı
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    _json_loads = json.loads
+
+
+def _json_bytes(obj: Any) -> bytes:
+    """Pretty (indent=2) UTF-8 JSON bytes; tek write_bytes ile yazılır."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
 # ==== SABİT PROJE AYARLARI (şimdilik gömülü) ====
 GCP_PROJECT_ID = "melodic-splicer-449022-g3"   # <-- kendi Project ID'in
 GCP_VERTEX_REGION = "us-central1"              # <-- Vertex AI bölgesi
@@ -26,6 +46,64 @@ os.environ["VERTEXAI_REGION"] = GCP_VERTEX_REGION
 # Çıktı klasörü
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 DESC_OUT_DIR = ROOT / "TheProd" / "output" / "descriptions"
+DESC_CACHE_DIR = DESC_OUT_DIR / ".cache"   # (görsel hash'leri + hints) → ham model cevabı
+
+# Model cevabından JSON ayıklama kalıpları
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.MULTILINE)
+_OBJ_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+# Gemini görselleri zaten ~768px'e indiriyor; büyük dosyaları göndermeden önce küçült
+DESC_DOWNSCALE = os.getenv("THEE_DESC_DOWNSCALE", "1") != "0"
+DESC_MAX_SIDE = int(os.getenv("THEE_DESC_MAX_SIDE", "1024"))
+DESC_JPEG_Q = 85
+
+
+@lru_cache(maxsize=64)
+def _mime_for(ext: str) -> str:
+    mime, _ = mimetypes.guess_type(f"x{ext}")
+    return mime or "image/jpeg"
+
+
+def _load_image_part(path: pathlib.Path) -> tuple[str, bytes]:
+    """(mime, bytes) for Gemini; large images are downscaled to a JPEG in memory."""
+    data = path.read_bytes()
+    if not DESC_DOWNSCALE:
+        return _mime_for(path.suffix.lower()), data
+    with Image.open(io.BytesIO(data)) as im:
+        if max(im.size) <= DESC_MAX_SIDE:
+            return _mime_for(path.suffix.lower()), data
+        im.draft("RGB", (DESC_MAX_SIDE, DESC_MAX_SIDE))  # JPEG: DCT-scaled decode
+        im.thumbnail((DESC_MAX_SIDE, DESC_MAX_SIDE), Image.Resampling.LANCZOS)
+        if im.mode in ("RGBA", "LA", "P"):
+            rgba = im.convert("RGBA")
+            im = Image.new("RGB", rgba.size, (255, 255, 255))
+            im.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            im = im.convert("RGB")
+        buf = io.BytesIO()
+        im.save(buf, "JPEG", quality=DESC_JPEG_Q)
+    return "image/jpeg", buf.getvalue()
+
+
+# --- Safety (ANAHTAR ARGÜMANLARLA); tüm örnekler aynı listeyi paylaşır ---
+_SAFETY = [
+    SafetySetting(
+        category=HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+    ),
+    SafetySetting(
+        category=HarmCategory.HARM_CATEGORY_HARASSMENT,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+    ),
+    SafetySetting(
+        category=HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+    ),
+    SafetySetting(
+        category=HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+    ),
+]
 
 
 @dataclass
@@ -47,33 +125,29 @@ class DescMaker:
     """
 
     def __init__(self) -> None:
-        aiplatform.init(project=GCP_PROJECT_ID, location=GCP_VERTEX_REGION)
-        self.model = GenerativeModel(GEMINI_MODEL_NAME)
-        # --- Safety (ANAHTAR ARGÜMANLARLA) ---
-        self.safety = [
-            SafetySetting(
-                category=HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            ),
-            SafetySetting(
-                category=HarmCategory.HARM_CATEGORY_HARASSMENT,
-                threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            ),
-            SafetySetting(
-                category=HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            ),
-            SafetySetting(
-                category=HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            ),
-        ]
+        # Vertex AI init + model ilk kullanımda (bkz. `model`); cache hit'te hiç kurulmaz
+        self._model: Optional[GenerativeModel] = None
+        self.safety = _SAFETY
+
+    @property
+    def model(self) -> GenerativeModel:
+        if self._model is None:
+            aiplatform.init(project=GCP_PROJECT_ID, location=GCP_VERTEX_REGION)
+            self._model = GenerativeModel(GEMINI_MODEL_NAME)
+        return self._model
 
     # ---- Public API: başka sınıflardan da çağır ----
-    def generate_for_images(self, image_paths: List[str], *, hints: Optional[str] = None) -> DescResult:
+    def generate_for_images(
+        self,
+        image_paths: List[str],
+        *,
+        hints: Optional[str] = None,
+        force: bool = False,
+    ) -> DescResult:
         """
         image_paths: 1–4 adet yerel görsel yolu (aynı ürüne ait).
         hints: Opsiyonel ürün anahtar kelimeleri/özellikleri (örn: "plate 23 cm, matte white, ceramic").
+        force: True ise cache'i atla ve modeli yeniden çağır.
         Dönüş: metinler ve kaydedilen dosya yolları (DescResult).
         """
         if not image_paths:
@@ -81,16 +155,18 @@ class DescMaker:
         if len(image_paths) > 4:
             raise ValueError("Maximum 4 images allowed")
 
-        parts = []
-        norm_paths: List[str] = []
+        paths: List[pathlib.Path] = []
         for p in image_paths:
             path = pathlib.Path(p).expanduser().resolve()
             if not path.exists():
                 raise FileNotFoundError(f"Image not found: {path}")
-            mime, _ = mimetypes.guess_type(str(path))
-            mime = mime or "image/jpeg"
-            parts.append(Part.from_data(mime_type=mime, data=path.read_bytes()))
-            norm_paths.append(str(path))
+            paths.append(path)
+        norm_paths: List[str] = [str(p) for p in paths]
+
+        # Dosyaları paralel oku + küçült (disk gecikmesi ve decode üst üste biner)
+        with ThreadPoolExecutor(max_workers=len(paths)) as ex:
+            blobs = list(ex.map(_load_image_part, paths))
+        parts = [Part.from_data(mime_type=mime, data=b) for mime, b in blobs]
 
         system = (
             "You are an elite Etsy SEO copywriter and visual merchandiser. "
@@ -127,18 +203,33 @@ class DescMaker:
             content_parts.append(extra)
         content_parts += [prompt, 'Return JSON as: {"title":"...","description":"..."}']
 
-        resp = self.model.generate_content(
-            content_parts,
-            safety_settings=self.safety,
-            generation_config={
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "top_k": 40,
-                "max_output_tokens": 900,
-            },
-        )
+        gen_cfg = {
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "top_k": 40,
+            "max_output_tokens": 900,
+        }
+        # prompt metni ya da ayarlar değişince anahtar da değişir (eski metin cache'ten gelmez)
+        text_parts = [p for p in content_parts if isinstance(p, str)]
+        cache_path = DESC_CACHE_DIR / f"{self._cache_key(blobs, text_parts, gen_cfg)}.json"
+        raw = None
+        if not force and cache_path.exists():
+            try:
+                raw = _json_loads(cache_path.read_bytes())["raw_text"]
+            except Exception:
+                raw = None
+
+        if raw is None:
+            resp = self.model.generate_content(
+                content_parts,
+                safety_settings=self.safety,
+                generation_config=gen_cfg,
+            )
+            raw = (resp.text or "").strip()
+            if raw:
+                DESC_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                cache_path.write_bytes(_json_bytes({"raw_text": raw}))
 
-        raw = (resp.text or "").strip()
         data = self._extract_json(raw)
 
         title = (data.get("title") or "Untitled Product").strip()
@@ -165,7 +256,7 @@ class DescMaker:
             "raw_text": raw,
             "created_at_utc": ts,
         }
-        out_json.write_text(json.dumps(payload, indent=2, ensure_ascii=False), encoding="utf-8")
+        out_json.write_bytes(_json_bytes(payload))
         out_md.write_text(
             f"# Etsy Listing Copy\n\n**Title**\n\n{title}\n\n"
             f"**Description**\n\n{description}\n",
@@ -183,8 +274,14 @@ class DescMaker:
         )
 
     # ---- Fonksiyonel arayüz (başka modüller için pratik) ----
-    def generate_listing_copy(self, image_paths: List[str], *, hints: Optional[str] = None) -> Dict[str, Any]:
-        r = self.generate_for_images(image_paths, hints=hints)
+    def generate_listing_copy(
+        self,
+        image_paths: List[str],
+        *,
+        hints: Optional[str] = None,
+        force: bool = False,
+    ) -> Dict[str, Any]:
+        r = self.generate_for_images(image_paths, hints=hints, force=force)
         return {
             "title": r.title,
             "description": r.description,
@@ -194,14 +291,36 @@ class DescMaker:
             "hints_used": r.hints_used,
         }
 
+    # ---- Cache anahtarı ----
+    @staticmethod
+    def _cache_key(
+        blobs: List[tuple[str, bytes]], text_parts: List[str], gen_cfg: Dict[str, Any]
+    ) -> str:
+        """Model + generation_config + tüm prompt metni (system/guidelines/hints) + görsel byte'larının (sırasız) hash'i."""
+        digests = sorted(hashlib.blake2b(b, digest_size=16).hexdigest() for _, b in blobs)
+        h = hashlib.blake2b(digest_size=16)
+        h.update(GEMINI_MODEL_NAME.encode())
+        h.update(b"\0" + json.dumps(gen_cfg, sort_keys=True).encode())
+        for t in text_parts:
+            h.update(b"\0" + t.encode("utf-8"))
+        for d in digests:
+            h.update(b"\0" + d.encode())
+        return h.hexdigest()
+
     # ---- JSON ayıklama ----
     def _extract_json(self, text: str) -> Dict[str, Any]:
-        cleaned = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip(), flags=re.MULTILINE)
+        text = text.strip()
+        # Hızlı yol: model çoğunlukla zaten saf JSON döner
+        try:
+            return _json_loads(text)
+        except ValueError:
+            pass
+        cleaned = _FENCE_RE.sub("", text)
         try:
-            return json.loads(cleaned)
-        except Exception:
-            m = re.search(r"\{.*\}", cleaned, flags=re.DOTALL)
-            return json.loads(m.group(0)) if m else {}
+            return _json_loads(cleaned)
+        except ValueError:
+            m = _OBJ_RE.search(cleaned)
+            return _json_loads(m.group(0)) if m else {}
 
 
 # ---- CLI ----
@@ -1,15 +1,29 @@
 # TheProd/PicPre.py
 from __future__ import annotations
 
+import hashlib
 import os
+import re
 import sys
 import json
 import shutil
 import pathlib
+import random
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
-from typing import List, Dict, Optional, Any
+from typing import Callable, List, Dict, Optional, Any, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+from urllib3.util.retry import Retry
+
+try:  # opsiyonel: orjson varsa JSON serialize çok daha hızlı
+    import orjson
+except ImportError:
+    orjson = None
 
 # --- Project root on sys.path (…/The E) ---
 ROOT = pathlib.Path(__file__).resolve().parents[1]
@@ -17,9 +31,10 @@ sys.path.insert(0, str(ROOT))
 
 # --- Local modules ---
 from TheImage.pubimg.s3_uploader import S3Uploader
-from TheImage.pubimg.edit_image import ImagePrep
+from TheImage.pubimg.edit_image import PREP_VERSION, RESIZE_REDUCING_GAP, ImagePrep
+from TheImage.pubimg.link_store import LinkStore, hash_file
 from TheImage.Claid.Claid_func import ClaidFunc
-from TheProd.PromtMaker import PromtMaker  # Gemini-based prompt generator
+from TheProd.PromtMaker import PromtMaker, GEMINI_MODEL_NAME, PROMPT_FINGERPRINT  # Gemini-based prompt generator
 
 # =========================
 # Settings (override via env)
@@ -29,6 +44,12 @@ S3_REGION   = os.getenv("THEE_S3_REGION",   "eu-north-1")
 
 IMAGES_DIR  = ROOT / "TheImage" / "pubimg" / "images"   # input folder
 OUTPUT_DIR  = ROOT / "TheProd" / "output"               # save results here
+PROMPT_CACHE_DIR = OUTPUT_DIR / ".cache" / "prompts"    # (image hash, prompt text, temp, style) → Gemini prompt
+
+# Reuse Gemini prompts for an identical prepped image + settings (THEE_PROMPT_CACHE=0 → always ask)
+PROMPT_CACHE = os.getenv("THEE_PROMPT_CACHE", "1") != "0"
+# Target length of each Gemini background prompt (words); part of the prompt cache key
+PROMPT_WORDS = 60
 
 # Guidance (kept for possible autoprompt toggles)
 GUIDELINES = os.getenv(
@@ -37,7 +58,7 @@ GUIDELINES = os.getenv(
 )
 
 # Allowed Claid aspect ratios (per docs)
-ALLOWED_RATIOS = {"5:12","9:16","4:7","7:9","4:5","1:1","9:7","19:13","7:4","16:9","12:5"}
+ALLOWED_RATIOS = frozenset({"5:12","9:16","4:7","7:9","4:5","1:1","9:7","19:13","7:4","16:9","12:5"})
 
 # Aspect → default fallback prompt (if Gemini fails)
 PROMPT_BY_ASPECT: Dict[str, str] = {
@@ -51,31 +72,127 @@ PROMPT_BY_ASPECT: Dict[str, str] = {
     ),
 }
 
+# Last-resort prompts (Gemini failed / unknown aspect)
+FALLBACK_PROMPT = (
+    "clean minimal studio background, soft lighting, natural shadows, subtle gradient backdrop, premium look"
+)
+FALLBACK_ASPECT_PROMPT = "clean studio, soft daylight, subtle realistic shadows, photorealistic"
+
+# Style hints cycled across Gemini prompt calls for variety
+STYLE_HINTS = (
+    "Minimal studio look with natural textures",
+    "Premium editorial catalog style, nuanced lighting",
+    "Warm lifestyle context, modern kitchen ambiance",
+    "Soft daylight with artisan aesthetic, tactile surfaces",
+    "Clean modern e-commerce product look, subtle gradient backdrop",
+    "Scandinavian minimalism, light wood tabletop, airy feel",
+    "Muted tones, linen backdrop, gentle falloff shadows",
+)
+
+# Per-aspect lookups resolved once: output key prefix ("9:7" → "9x7") and fallback prompt
+_KEY_BY_ASPECT: Dict[str, str] = {a: a.replace(":", "x") for a in ALLOWED_RATIOS}
+_PROMPT_FOR_ASPECT: Dict[str, str] = {
+    a: PROMPT_BY_ASPECT.get(a) or FALLBACK_ASPECT_PROMPT for a in ALLOWED_RATIOS
+}
+
 # Default behavior (backward compatible): two images, both 1:1
 DEFAULT_ASPECTS_ENV = os.getenv("THEE_ASPECTS", "1:1,1:1")
 DEFAULT_ASPECTS: List[str] = [a.strip() for a in DEFAULT_ASPECTS_ENV.split(",") if a.strip()]
 
-HTTP_TIMEOUT = 90
+# Final scene format requested from Claid. png keeps transparency/lossless; jpeg/webp are
+# several times smaller for opaque product shots (less to transfer, less to write).
+OUTPUT_FORMAT = os.getenv("THEE_OUTPUT_FORMAT", "png").lower()
+_EXT_BY_FORMAT = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+
+HTTP_TIMEOUT = (5, 30)  # (connect, read) — a stalled CDN response fails fast and gets retried
+
+# Transient network errors on result downloads (idempotent GETs) → retried with exponential backoff + jitter
+RETRY_ATTEMPTS = int(os.getenv("THEE_RETRY_ATTEMPTS", "3"))
+# HTTP statuses worth another try (rate limit / transient CDN errors)
+_RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+class _TransientHTTPError(requests.HTTPError):
+    """raise_for_status() for a status in _RETRY_STATUS; _with_retry retries it."""
+
+
+# r.raw reads raise urllib3 errors directly (requests only wraps them in iter_content)
+_RETRYABLE = (requests.Timeout, requests.ConnectionError, ReadTimeoutError, ProtocolError, _TransientHTTPError)
+
+# Max concurrent Claid scene calls per pipeline run (network-bound; keep under API rate limits)
+SCENE_CONCURRENCY = int(os.getenv("THEE_SCENE_CONCURRENCY", "5"))
+# Hard cap on Claid requests in flight per PicPre (shared by all pipelines in batch mode)
+CLAID_MAX_INFLIGHT = int(os.getenv("THEE_CLAID_MAX_INFLIGHT", "5"))
+# Claid tmp_url'ler ~24 saat yaşar; cutout/scene cache bu süreden önce tazelenir
+CUTOUT_TTL_S = int(float(os.getenv("THEE_CUTOUT_TTL_H", "20")) * 3600)
+# Max concurrent Gemini prompt calls (one per requested output)
+GEMINI_CONCURRENCY = int(os.getenv("THEE_GEMINI_CONCURRENCY", "5"))
+# Max concurrent result downloads
+DOWNLOAD_CONCURRENCY = int(os.getenv("THEE_DOWNLOAD_CONCURRENCY", "8"))
+# Read/write block size for streamed downloads (multi-MB PNGs → fewer syscalls)
+COPY_BUFSIZE = 1 << 20
+# Max source images in the Claid stage at once (batch mode); each one fans out SCENE_CONCURRENCY calls
+BATCH_CONCURRENCY = int(os.getenv("THEE_BATCH_CONCURRENCY", "2"))
+
+# Sidecar in images_dir that remembers which inputs the batch mode already handled
+PROCESSED_FILE = ".processed.json"
 
 
 # =========================
 # Small utilities
 # =========================
+def _dumps(obj: Any) -> str:
+    """Pretty (indent=2) JSON text, non-ASCII kept as-is."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode("utf-8")
+    return json.dumps(obj, indent=2, ensure_ascii=False)
+
+
+# Anything outside [A-Za-z0-9-._] (spaces, Turkish letters, ...) becomes "-"
+_SLUG_RE = re.compile(r"[^A-Za-z0-9._-]")
+
+_IMG_EXTS = frozenset({".png", ".jpg", ".jpeg", ".webp"})
+
+
 def _slugify(name: str) -> str:
     """Make a file-system friendly base name."""
-    base = name.strip().replace(" ", "-")
-    allowed = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-._"
-    cleaned = "".join(ch if ch in allowed else "-" for ch in base)
-    return cleaned[:120]
+    return _SLUG_RE.sub("-", name.strip())[:120]
+
+
+def _scan_images(folder: pathlib.Path):
+    """Yield (mtime, path) for image files; DirEntry caches stat info from the directory read."""
+    try:
+        it = os.scandir(folder)
+    except FileNotFoundError:
+        return
+    with it:
+        for e in it:
+            if not e.is_file():
+                continue
+            n = e.name
+            i = n.rfind(".")
+            if i < 0 or n[i:].lower() not in _IMG_EXTS:
+                continue
+            yield e.stat().st_mtime, pathlib.Path(e.path)
+
+
+# folder → (folder mtime_ns, images old→new); a directory's mtime changes on add/remove/rename
+_SCAN_CACHE: Dict[str, Tuple[int, List[pathlib.Path]]] = {}
 
 
 def _list_images(folder: pathlib.Path) -> List[pathlib.Path]:
-    """List images in mtime order (old→new)."""
-    if not folder.exists():
+    """List images in mtime order (old→new); rescans only when the folder itself changed."""
+    try:
+        stamp = os.stat(folder).st_mtime_ns
+    except FileNotFoundError:
         return []
-    exts = {".png", ".jpg", ".jpeg", ".webp"}
-    imgs = [p for p in folder.iterdir() if p.is_file() and p.suffix.lower() in exts]
-    return sorted(imgs, key=lambda p: p.stat().st_mtime)
+    key = str(folder)
+    hit = _SCAN_CACHE.get(key)
+    if hit and hit[0] == stamp:
+        return list(hit[1])
+    imgs = [p for _, p in sorted(_scan_images(folder), key=lambda t: t[0])]
+    _SCAN_CACHE[key] = (stamp, imgs)
+    return list(imgs)
 
 
 def _latest_image_in(folder: pathlib.Path) -> Optional[pathlib.Path]:
@@ -84,14 +201,38 @@ def _latest_image_in(folder: pathlib.Path) -> Optional[pathlib.Path]:
     return imgs[-1] if imgs else None
 
 
-def _download(url: str, dest: pathlib.Path) -> pathlib.Path:
-    """Download a URL to a local path."""
-    dest.parent.mkdir(parents=True, exist_ok=True)
-    with requests.get(url, stream=True, timeout=HTTP_TIMEOUT) as r:
-        r.raise_for_status()
-        with open(dest, "wb") as f:
-            shutil.copyfileobj(r.raw, f)
-    return dest
+def _with_retry(fn, *args, attempts: int = RETRY_ATTEMPTS, initial: float = 0.5, cap: float = 5.0, **kwargs):
+    """Call fn(*args, **kwargs); retry transient network errors with full-jitter exponential backoff."""
+    for attempt in range(attempts):
+        try:
+            return fn(*args, **kwargs)
+        except _RETRYABLE as e:
+            if attempt == attempts - 1:
+                raise
+            delay = random.uniform(0, min(cap, initial * 2 ** attempt))
+            print(f"⚠️  {type(e).__name__}, {delay:.1f}s sonra tekrar denenecek ({attempt + 1}/{attempts})")
+            time.sleep(delay)
+
+
+def _check_ratios(ratios: List[str]) -> List[str]:
+    """Validate aspect ratios against Claid's list; empty → ["1:1"]."""
+    ratios = ratios or ["1:1"]
+    for a in ratios:
+        if a not in ALLOWED_RATIOS:
+            raise ValueError(f"Unsupported aspect ratio for Claid: {a}")
+    return ratios
+
+
+def _check_quantity(quantity: int) -> int:
+    if not (1 <= int(quantity) <= 5):
+        raise ValueError("quantity must be between 1 and 5")
+    return int(quantity)
+
+
+def _file_sig(p: pathlib.Path) -> Dict[str, int]:
+    """Cheap change detector for the processed sidecar (size + mtime)."""
+    st = p.stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
 
 
 # =========================
@@ -113,6 +254,7 @@ class PicPre:
       - quantity: total number of output images to create (1..5). If omitted, defaults to len(ratios).
       - default_scale: smaller => product appears smaller; default 0.72
       - default_y: None => centered; or 0..1 to nudge vertical placement
+      - output_format: "png" (default, THEE_OUTPUT_FORMAT), "jpeg" or "webp" for smaller finals
     """
 
     def __init__(
@@ -126,33 +268,52 @@ class PicPre:
         default_scale: Optional[float] = 0.72,  # smaller product by default
         default_y: Optional[float] = None,      # None => center (Claid_func normalizes)
         quantity: Optional[int] = None,         # total output count (1..5). If None → len(ratios)
+        output_format: str = OUTPUT_FORMAT,     # "png" | "jpeg" | "webp"
     ) -> None:
         self.images_dir = pathlib.Path(images_dir)
         self.output_dir = pathlib.Path(output_dir)
-        self.s3 = S3Uploader(bucket_name=s3_bucket, region=s3_region)
-        self.claid = ClaidFunc()
         self.prep = ImagePrep()  # can be tuned via env in edit_image.py
+        # content key → S3 URL index next to the prepped files; repeat runs skip even the HEAD check
+        self.s3 = S3Uploader(
+            bucket_name=s3_bucket,
+            region=s3_region,
+            known_index=str(self.prep.out_dir / "s3_index.json"),
+        )
+        self.claid = ClaidFunc()
+        self._claid_slots = threading.BoundedSemaphore(max(1, CLAID_MAX_INFLIGHT))
+        # keep-alive session for result downloads (same CDN host → reuse TLS connections)
+        self._http = requests.Session()
+        # no adapter-level retries: downloads are retried once, by _with_retry (jittered, status-aware);
+        # stacking both multiplied attempts and backoff (3 × 4 requests per final)
+        self._http.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=Retry(total=0)))
+        # source-hash → (prepped path, S3 URL, prep report); lets re-runs skip prep + upload
+        self.links = LinkStore(str(self.prep.out_dir / "index.json"))
         self.guidelines = guidelines
+        # S3 URL (content-addressed) → Claid cutout tmp_url + expiry
+        self.cutouts = LinkStore(str(self.prep.out_dir / "cutouts.json"))
+        self._cutout_lock = threading.Lock()
+        # (cutout, aspect, prompt, nonce) → (scene tmp_url, expires_at); skips Claid calls that were
+        # already made while the tmp_url is still served (PicPre may live across builds)
+        self._scene_cache: Dict[str, Tuple[str, float]] = {}
+        # prompt cache file name → prompt (in-process layer over PROMPT_CACHE_DIR)
+        self._prompt_cache: Dict[str, str] = {}
 
         # validate/prepare ratios
-        base_ratios = list(ratios) if ratios else list(DEFAULT_ASPECTS)
-        if not base_ratios:
-            base_ratios = ["1:1"]
-        for a in base_ratios:
-            if a not in ALLOWED_RATIOS:
-                raise ValueError(f"Unsupported aspect ratio for Claid: {a}")
-        self.ratios = base_ratios
+        self.ratios = _check_ratios(list(ratios) if ratios else list(DEFAULT_ASPECTS))
 
         # quantity: default to number of ratios; clamp to 1..5
         if quantity is None:
             quantity = max(1, min(5, len(self.ratios)))
-        if not (1 <= int(quantity) <= 5):
-            raise ValueError("quantity must be between 1 and 5")
-        self.quantity = int(quantity)
+        self.quantity = _check_quantity(quantity)
 
         self.default_scale = default_scale
         self.default_y = default_y
 
+        output_format = output_format.lower()
+        if output_format not in _EXT_BY_FORMAT:
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.output_format = output_format
+
     # ---------- Public entrypoints ----------
 
     def run_auto(
@@ -161,6 +322,7 @@ class PicPre:
         *,
         quantity: Optional[int] = None,
         ratios: Optional[List[str]] = None,
+        use_prompt_cache: bool = True,
     ) -> Dict[str, Any]:
         """
         Unified entrypoint:
@@ -169,37 +331,89 @@ class PicPre:
 
         You can override quantity/ratios call-time, e.g.:
           PicPre().run_auto("/path.jpg", quantity=3, ratios=["1:1","9:7"])
+        use_prompt_cache=False asks Gemini for fresh prompts (e.g. "generate more" for the same
+        product); the new prompts still replace the cached ones.
         """
-        if quantity is not None or ratios is not None:
-            tmp = PicPre(
-                images_dir=self.images_dir,
-                output_dir=self.output_dir,
-                s3_bucket=S3_BUCKET,
-                s3_region=S3_REGION,
-                guidelines=self.guidelines,
-                ratios=ratios if ratios else self.ratios,
-                default_scale=self.default_scale,
-                default_y=self.default_y,
-                quantity=quantity if quantity is not None else self.quantity,
-            )
-            return tmp.run_for_image(image_path) if image_path else tmp.run()
-        return self.run_for_image(image_path) if image_path else self.run()
+        # Overrides are threaded through the pipeline; clients (S3/Claid/prep) are reused
+        kw = {"ratios": ratios, "quantity": quantity, "use_prompt_cache": use_prompt_cache}
+        return self.run_for_image(image_path, **kw) if image_path else self.run(**kw)
 
-    def run(self) -> Dict[str, Any]:
+    def run(
+        self,
+        *,
+        ratios: Optional[List[str]] = None,
+        quantity: Optional[int] = None,
+        use_prompt_cache: bool = True,
+    ) -> Dict[str, Any]:
         """Process the latest image from IMAGES_DIR (default behavior)."""
         src = _latest_image_in(self.images_dir)
         if not src:
             raise FileNotFoundError(f"Görsel bulunamadı: {self.images_dir}")
         print(f"🖼  Son görsel: {src.name}")
-        return self._pipeline(src)
+        return self._pipeline(src, ratios=ratios, quantity=quantity, use_prompt_cache=use_prompt_cache)
 
-    def run_for_image(self, image_path: str) -> Dict[str, Any]:
+    def run_for_image(
+        self,
+        image_path: str,
+        *,
+        ratios: Optional[List[str]] = None,
+        quantity: Optional[int] = None,
+        use_prompt_cache: bool = True,
+    ) -> Dict[str, Any]:
         """Process a specific image given by absolute/relative path."""
         src = pathlib.Path(image_path).expanduser().resolve()
         if not src.exists():
             raise FileNotFoundError(f"Image not found: {src}")
         print(f"🖼  Seçilen görsel: {src.name}")
-        return self._pipeline(src)
+        return self._pipeline(src, ratios=ratios, quantity=quantity, use_prompt_cache=use_prompt_cache)
+
+    def run_batch(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Process every not-yet-processed image in images_dir (newest `limit` ones if given).
+        Handled inputs are recorded in images_dir/.processed.json so re-runs skip them.
+        """
+        processed = self._load_processed()
+        todo = [
+            p for p in _list_images(self.images_dir)
+            if processed.get(p.name) != _file_sig(p)
+        ]
+        if limit is not None:
+            todo = todo[-limit:] if limit > 0 else []
+        if not todo:
+            print(f"ℹ️  İşlenecek yeni görsel yok: {self.images_dir}")
+            return []
+
+        print(f"🗂  {len(todo)} görsel işlenecek")
+        results = self.run_many([str(p) for p in todo], max_concurrency=BATCH_CONCURRENCY)
+        for p in todo:
+            processed[p.name] = _file_sig(p)
+        self._save_processed(processed)
+        return results
+
+    def run_many(self, image_paths: List[str], max_concurrency: int = 1) -> List[Dict[str, Any]]:
+        """
+        Process several images, pipelined:
+        prep + S3 upload of image N+1 runs while Claid/Gemini work on image N.
+        `max_concurrency` images may be in the Claid stage at the same time.
+        Results come back in input order.
+        """
+        srcs = [pathlib.Path(p).expanduser().resolve() for p in image_paths]
+        for src in srcs:
+            if not src.exists():
+                raise FileNotFoundError(f"Image not found: {src}")
+
+        def _run_staged(src: pathlib.Path, fut) -> Dict[str, Any]:
+            staged = fut.result()
+            print(f"🖼  Sıradaki görsel: {src.name}")
+            return self._pipeline(src, staged=staged)
+
+        workers = max(1, min(max_concurrency, len(srcs) or 1))
+        # single prep worker: keeps LinkStore writes serial, runs ahead of the Claid stage
+        with ThreadPoolExecutor(max_workers=1) as prep_ex, \
+                ThreadPoolExecutor(max_workers=workers) as claid_ex:
+            staged = [prep_ex.submit(self._prep_and_upload, src) for src in srcs]
+            futs = [claid_ex.submit(_run_staged, src, f) for src, f in zip(srcs, staged)]
+            return [f.result() for f in futs]
 
     # ---------- Discovery helpers (UI/CLI'e faydalı) ----------
     def list_inputs(self, limit: int = 20) -> List[str]:
@@ -207,109 +421,205 @@ class PicPre:
         return [str(p) for p in _list_images(self.images_dir)][-limit:]
 
     # ---------- Core pipeline ----------
-    def _pipeline(self, src: pathlib.Path) -> Dict[str, Any]:
-        """Shared core pipeline that both run() and run_for_image() use."""
-        self.output_dir.mkdir(parents=True, exist_ok=True)
+    def _pipeline(
+        self,
+        src: pathlib.Path,
+        staged: Optional[Tuple[str, Dict[str, Any], str]] = None,
+        *,
+        ratios: Optional[List[str]] = None,
+        quantity: Optional[int] = None,
+        use_prompt_cache: bool = True,
+    ) -> Dict[str, Any]:
+        """Shared core pipeline that run(), run_for_image() and run_many() use.
 
-        # 1) Pre-Claid prepping (resize/denoise/sharpen/format)
-        prepped_path, prep_report = self.prep.prepare(src)
-        print(f"🧼 Prepped image: {pathlib.Path(prepped_path).name}")
+        `staged` is an already finished `_prep_and_upload(src)` result (run_many prefetches it).
+        `ratios` / `quantity` override the instance defaults for this call only.
+        `use_prompt_cache=False` skips cached Gemini prompts for this call.
+        """
+        ratios = _check_ratios(list(ratios)) if ratios else self.ratios
+        quantity = _check_quantity(quantity) if quantity is not None else self.quantity
+        self.output_dir.mkdir(parents=True, exist_ok=True)
 
-        # 2) Upload to S3 (Claid will consume this public URL)
-        s3_url = self._ensure_s3_url(pathlib.Path(prepped_path))
+        # 1-2) Pre-Claid prepping + S3 upload (skipped when this exact source was done before)
+        prepped_path, prep_report, s3_url = staged or self._prep_and_upload(src)
         print(f"☁️  S3 URL: {s3_url}")
 
-        # 3) Generate N diverse Gemini prompts from local prepped image
-        prompts_overrides = self._gemini_prompts_from_local(str(prepped_path), count=self.quantity)
-
-        # 4) Remove background (transparent cutout URL)
-        cutout_url = self._remove_bg(s3_url)
-        print(f"✂️  Cutout URL: {cutout_url}")
-
-        # 5) Create exactly `self.quantity` scenes, cycling through ratios (and prompts)
-        urls_by_key = self._make_images(
-            cutout_url,
-            desired_count=self.quantity,
-            ratios=self.ratios,
-            prompt_override=prompts_overrides,
-        )
-        for key, u in urls_by_key.items():
-            print(f"⭐ {key}: {u}")
+        # 3-4) Gemini prompts (local prepped file) and Claid remove_bg (S3 URL) are independent
+        #      → prompts run in the background while the cutout is made
+        with ThreadPoolExecutor(max_workers=1) as ex:
+            fut_prompts = ex.submit(
+                self._gemini_prompts_from_local, str(prepped_path), quantity, use_cache=use_prompt_cache
+            )
+            cutout_url = self._remove_bg(s3_url)
+            print(f"✂️  Cutout URL: {cutout_url}")
+            prompts_overrides = fut_prompts.result()
 
-        # 6) Download finals locally
-        saved = self._download_many(urls_by_key, basename=_slugify(src.stem))
+        # 5-6) Create exactly `quantity` scenes (cycling through ratios and prompts);
+        #      each final starts downloading as soon as its scene is ready
+        basename = _slugify(src.stem)
+        ts = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        downloads: Dict[str, Any] = {}
+        with ThreadPoolExecutor(max_workers=max(1, DOWNLOAD_CONCURRENCY)) as dl_ex:
+            def _on_scene(key: str, url: str) -> None:
+                print(f"⭐ {key}: {url}")
+                downloads[key] = dl_ex.submit(_with_retry, self._download, url, self._dest_for(basename, key, ts))
+
+            urls_by_key = self._make_images(
+                cutout_url,
+                desired_count=quantity,
+                ratios=ratios,
+                prompt_override=prompts_overrides,
+                on_scene=_on_scene,
+            )
+            for fut in downloads.values():
+                fut.result()
+        saved = {key: str(self._dest_for(basename, key, ts)) for key in urls_by_key}
 
         return {
             "source_path": str(src),
             "prepped_path": str(prepped_path),
-            "prep_report": prep_report.to_dict(),
+            "prep_report": prep_report,
             "s3_url": s3_url,
             "cutout_url": cutout_url,
             "result_urls": urls_by_key,
             "saved_files": saved,
             "output_dir": str(self.output_dir),
-            "quantity": self.quantity,
-            "ratios": self.ratios,
+            "quantity": quantity,
+            "ratios": ratios,
         }
 
     # ---------- Internals ----------
-    def _ensure_s3_url(self, local_path: pathlib.Path) -> str:
-        """Upload local path to S3 and return public URL."""
-        return self.s3.upload_file(str(local_path))
+    def _load_processed(self) -> Dict[str, Any]:
+        path = self.images_dir / PROCESSED_FILE
+        if not path.exists():
+            return {}
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            return {}
+
+    def _save_processed(self, processed: Dict[str, Any]) -> None:
+        path = self.images_dir / PROCESSED_FILE
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(_dumps(processed), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def _prep_key(self, src: pathlib.Path) -> str:
+        """Content hash of the source + prep algorithm version + every setting that shapes the output."""
+        p = self.prep
+        params = (
+            f"v{PREP_VERSION}-{p.min_long}-{p.max_long}-{p.target_long}-{p.jpeg_quality}"
+            f"-{int(p.jpeg_optimize)}-{RESIZE_REDUCING_GAP:g}"
+        )
+        return f"{hash_file(str(src))}-{params}"
+
+    def _prep_and_upload(self, src: pathlib.Path) -> Tuple[str, Dict[str, Any], str]:
+        """Return (prepped_path, prep_report dict, s3_url), reusing a previous run when possible."""
+        key = self._prep_key(src)
+        row = self.links.get_row(key)
+        if row and row.get("report") and pathlib.Path(row["path"]).exists():
+            print(f"♻️  Prep + upload cache hit: {pathlib.Path(row['path']).name}")
+            return row["path"], row["report"], row["url"]
+
+        # 1) Pre-Claid prepping (resize/denoise/sharpen/format), kept in memory
+        #    File name carries a short hash of the cache key: same-stem sources (or the same source
+        #    under other prep settings) get their own file, so a cache row never points at another's pixels
+        tag = hashlib.blake2b(key.encode("utf-8"), digest_size=6).hexdigest()
+        buf, prep_report = self.prep.prepare_to_buffer(src, tag=tag)
+        prepped_path = prep_report.output_path
+        print(f"🧼 Prepped image: {pathlib.Path(prepped_path).name}")
+
+        # 2) Upload to S3 straight from the buffer (Claid will consume this public URL).
+        #    The local copy (needed for Gemini prompts and the prep cache) is written meanwhile.
+        with ThreadPoolExecutor(max_workers=1) as ex:
+            written = ex.submit(pathlib.Path(prepped_path).write_bytes, buf.getbuffer())
+            s3_url = self.s3.upload_fileobj_dedup(buf, prepped_path)
+            written.result()
+
+        report = prep_report.to_dict()
+        self.links.set(key, prepped_path, s3_url, report=report)
+        return prepped_path, report, s3_url
 
     def _remove_bg(self, input_url: str) -> str:
-        """Call Claid remove_background (URL) and return cutout tmp_url."""
-        data = self.claid.remove_background_url(
-            input_url=input_url,
-            category="products",
-            clipping=True,
-            color="transparent",
-            output_type="png",
-            decompress="strong",
-            polish=False,
-        )
+        """Call Claid remove_background (URL) and return cutout tmp_url (cached until it expires)."""
+        with self._cutout_lock:
+            row = self.cutouts.get_row(input_url)
+        if row and row.get("expires_at", 0) > time.time() and self._url_alive(row["url"]):
+            print("♻️  Cutout cache hit")
+            return row["url"]
+
+        # Claid POST'ları burada tekrar denenmez: ClaidFunc session'ı tek retry katmanı
+        # (yalnızca bağlantı hatası / 429); ücretli istek iki kez gönderilmez
+        with self._claid_slots:
+            data = self.claid.remove_background_url(
+                input_url=input_url,
+                category="products",
+                clipping=True,
+                color="transparent",
+                output_type="png",
+                decompress="strong",
+                polish=False,
+            )
         out = (data or {}).get("output", {})
         url = out.get("tmp_url")
         if not url:
             raise RuntimeError(f"Claid remove_background_url failed: {data}")
+        with self._cutout_lock:
+            self.cutouts.set(input_url, input_url, url, expires_at=int(time.time()) + CUTOUT_TTL_S)
         return url
 
-    def _gemini_prompts_from_local(self, prepped_path: str, count: int = 2) -> List[str]:
+    def _url_alive(self, url: str) -> bool:
+        """Quick HEAD check that a cached tmp_url is still served."""
+        try:
+            with self._http.head(url, timeout=5, allow_redirects=True) as r:
+                return r.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def _gemini_prompts_from_local(self, prepped_path: str, count: int = 2, *, use_cache: bool = True) -> List[str]:
         """
         Generate `count` creative prompts via PromtMaker with varying temperatures / style hints.
         Ensures at least `count` prompts for maximum diversity.
+        `use_cache=False` ignores cached prompts (fresh ones are still stored).
         """
         prompts: List[str] = []
         try:
-            pm = PromtMaker()
-
             # spread temperatures around a base range
             temps = [0.6 + 0.1 * i for i in range(max(1, count))]  # 0.6, 0.7, 0.8, ...
-            style_hints = [
-                "Minimal studio look with natural textures",
-                "Premium editorial catalog style, nuanced lighting",
-                "Warm lifestyle context, modern kitchen ambiance",
-                "Soft daylight with artisan aesthetic, tactile surfaces",
-                "Clean modern e-commerce product look, subtle gradient backdrop",
-                "Scandinavian minimalism, light wood tabletop, airy feel",
-                "Muted tones, linen backdrop, gentle falloff shadows",
-            ]
-
-            for i in range(count):
-                res = pm.analyze_and_prompt(
-                    prepped_path,
-                    temperature=temps[i % len(temps)],
-                    style_hint=style_hints[i % len(style_hints)]
-                )
-                p = (res.claid_prompt or "").strip()
-                if p:
-                    prompts.append(p)
+            specs = [(temps[i % len(temps)], STYLE_HINTS[i % len(STYLE_HINTS)]) for i in range(count)]
+
+            # Cached variants first; Gemini (and its client init) only for the rest
+            digest = hash_file(prepped_path) if PROMPT_CACHE else None
+            found = [self._cached_prompt(digest, t, h) if use_cache else None for t, h in specs]
+            missing = [i for i, p in enumerate(found) if p is None]
+            if missing:
+                pm = PromtMaker()
+
+                # Variants are independent Gemini requests → run them together, keep index order
+                def _one(i: int) -> str:
+                    res = pm.analyze_and_prompt(
+                        prepped_path,
+                        temperature=specs[i][0],
+                        style_hint=specs[i][1],
+                        prompt_words=PROMPT_WORDS,
+                    )
+                    return (res.claid_prompt or "").strip()
+
+                workers = max(1, min(GEMINI_CONCURRENCY, len(missing)))
+                with ThreadPoolExecutor(max_workers=workers) as ex:
+                    fresh = list(ex.map(_one, missing))
+                for i, p in zip(missing, fresh):
+                    found[i] = p
+                    if p:
+                        self._store_prompt(digest, *specs[i], p)
+            else:
+                print("♻️  Gemini prompts from cache")
+
+            prompts = [p for p in found if p]
 
             # Fallbacks if model returns too little
             if not prompts:
-                prompts = [
-                    "clean minimal studio background, soft lighting, natural shadows, subtle gradient backdrop, premium look"
-                ] * count
+                prompts = [FALLBACK_PROMPT] * count
             elif len(prompts) < count:
                 base = prompts[-1]
                 prompts += [base] * (count - len(prompts))
@@ -320,27 +630,58 @@ class PicPre:
 
         except Exception as e:
             print(f"⚠️ Gemini prompt generation failed: {e}")
-            prompts = [
-                "clean minimal studio background, soft lighting, natural shadows, subtle gradient backdrop, premium look"
-            ] * count
+            prompts = [FALLBACK_PROMPT] * count
 
         return prompts
 
+    def _prompt_cache_path(self, digest: str, temperature: float, style_hint: str) -> pathlib.Path:
+        # PROMPT_FINGERPRINT: PromtMaker's prompt text / schema / downscale size → edits invalidate old entries
+        raw = f"{GEMINI_MODEL_NAME}|{PROMPT_FINGERPRINT}|{PROMPT_WORDS}|{digest}|{temperature:.2f}|{style_hint}"
+        return PROMPT_CACHE_DIR / f"{hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()}.json"
+
+    def _cached_prompt(self, digest: Optional[str], temperature: float, style_hint: str) -> Optional[str]:
+        """Previously generated prompt for this image/settings, or None."""
+        if digest is None:
+            return None
+        path = self._prompt_cache_path(digest, temperature, style_hint)
+        hit = self._prompt_cache.get(path.name)
+        if hit is None and path.exists():
+            try:
+                hit = json.loads(path.read_bytes())["claid_prompt"]
+            except Exception:
+                return None
+            self._prompt_cache[path.name] = hit
+        return hit
+
+    def _store_prompt(self, digest: Optional[str], temperature: float, style_hint: str, prompt: str) -> None:
+        if digest is None:
+            return
+        path = self._prompt_cache_path(digest, temperature, style_hint)
+        self._prompt_cache[path.name] = prompt
+        try:
+            PROMPT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            path.write_text(_dumps({"claid_prompt": prompt}), encoding="utf-8")
+        except OSError as e:
+            print(f"⚠️ Prompt cache write failed: {e}")
+
     def _make_images(
         self,
         cutout_url: str,
         *,
         desired_count: int,
         ratios: List[str],
-        prompt_override: Optional[object] = None
+        prompt_override: Optional[object] = None,
+        on_scene: Optional[Callable[[str, str], None]] = None,
     ) -> Dict[str, str]:
         """
         Create exactly `desired_count` images, cycling through given `ratios` and `prompt_override`.
         Keys look like: {"1x1_1": url, "1x1_2": url, "9x7_1": url, ...}
+        `on_scene(key, url)` is called as soon as each scene is ready (from a worker thread).
         """
-        out: Dict[str, str] = {}
         counters: Dict[str, int] = {}
         prompt_idx = 0
+        jobs: List[Tuple[str, str]] = []
+        names: List[str] = []
 
         if not ratios:
             ratios = ["1:1"]
@@ -358,45 +699,98 @@ class PicPre:
             elif isinstance(prompt_override, str) and prompt_override:
                 prompt = prompt_override
             else:
-                prompt = PROMPT_BY_ASPECT.get(aspect) or (
-                    "clean studio, soft daylight, subtle realistic shadows, photorealistic"
-                )
+                prompt = _PROMPT_FOR_ASPECT[aspect]
 
             print(f"📝 [{i+1}/{desired_count}] Using prompt for {aspect}: {prompt}")
-
+            jobs.append((aspect, prompt))
+            # deterministic naming from job order, known before any scene returns
+            counters[aspect] = counters.get(aspect, 0) + 1
+            names.append(f"{_KEY_BY_ASPECT[aspect]}_{counters[aspect]}")
+
+        # Repeated (aspect, prompt) pairs are intentional variants → the occurrence
+        # number goes into the key, so only a true re-run of the same request hits the cache
+        seen: Dict[Tuple[str, str], int] = {}
+        keys: List[str] = []
+        for job in jobs:
+            seen[job] = seen.get(job, 0) + 1
+            raw = f"{cutout_url}|{job[0]}|{job[1]}|{seen[job]}"
+            keys.append(hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest())
+
+        # cache hit only while the tmp_url is unexpired and still served (same guard as cutouts)
+        now = time.time()
+        results: Dict[int, str] = {}
+        for i, k in enumerate(keys):
+            row = self._scene_cache.get(k)
+            if row and row[1] > now and self._url_alive(row[0]):
+                results[i] = row[0]
+        todo = [i for i in range(len(keys)) if i not in results]
+        if on_scene:
+            for i, url in results.items():
+                on_scene(names[i], url)
+
+        def _scene(i: int) -> None:
+            url = self._one_scene(cutout_url, *jobs[i])
+            self._scene_cache[keys[i]] = (url, time.time() + CUTOUT_TTL_S)
+            results[i] = url
+            if on_scene:
+                on_scene(names[i], url)
+
+        # Scenes are independent → run the uncached ones concurrently.
+        # Fail fast: on the first error, queued scenes are cancelled instead of run.
+        if todo:
+            workers = max(1, min(SCENE_CONCURRENCY, len(todo)))
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                futs = [ex.submit(_scene, i) for i in todo]
+                done, pending = wait(futs, return_when=FIRST_EXCEPTION)
+                for f in pending:
+                    f.cancel()
+                for f in done:
+                    f.result()
+
+        return {name: results[i] for i, name in enumerate(names)}
+
+    def _one_scene(self, cutout_url: str, aspect: str, prompt: str) -> str:
+        """One Claid add_background call (single image); returns its tmp_url."""
+        # retry ClaidFunc session'ında (bkz. _remove_bg)
+        with self._claid_slots:
             scene = self.claid.add_background(
                 object_image_url=cutout_url,
                 use_autoprompt=False,
                 prompt=prompt,
                 guidelines=self.guidelines,              # ignored since explicit prompt path
                 aspect_ratio=aspect,
-                number_of_images=1,                      # deterministic naming; loop per image
+                number_of_images=1,                      # deterministic naming; one call per image
                 preference="optimal",
-                output_format="png",
+                output_format=self.output_format,
                 scale=self.default_scale,
                 position={"x": 0.5, "y": self.default_y} if self.default_y is not None else None,
             )
 
-            urls = scene.get("tmp_urls") or []
-            if not urls:
-                raise RuntimeError(f"Scene failed for aspect {aspect}: {scene}")
-
-            counters[aspect] = counters.get(aspect, 0) + 1
-            key = f"{aspect.replace(':','x')}_{counters[aspect]}"
-            out[key] = urls[0]
-
-        return out
-
-    def _download_many(self, urls_by_aspect: Dict[str, str], basename: str) -> Dict[str, str]:
-        """Download all generated images to OUTPUT_DIR with deterministic names."""
-        ts = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
-        saved: Dict[str, str] = {}
-        for key, url in urls_by_aspect.items():
-            name = f"{basename}__{key}__{ts}.png"
-            path = self.output_dir / name
-            _download(url, path)
-            saved[key] = str(path)
-        return saved
+        urls = scene.get("tmp_urls") or []
+        if not urls:
+            raise RuntimeError(f"Scene failed for aspect {aspect}: {scene}")
+        return urls[0]
+
+    def _download(self, url: str, dest: pathlib.Path) -> pathlib.Path:
+        """Download a URL to a local path."""
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        with self._http.get(url, stream=True, timeout=HTTP_TIMEOUT) as r:
+            if r.status_code in _RETRY_STATUS:
+                raise _TransientHTTPError(f"{r.status_code} for url: {url}", response=r)
+            r.raise_for_status()
+            # gzip/deflate ile gelirse diske çözülmüş hali yazılsın (yoksa ham byte'lar aynen geçer)
+            r.raw.decode_content = True
+            size = int(r.headers.get("Content-Length") or 0)
+            with open(dest, "wb") as f:
+                if size and not r.headers.get("Content-Encoding") and hasattr(os, "posix_fallocate"):
+                    # tek seferde yer ayır → parçalanma yok; boyut birebir bilindiği için sonunda truncate gerekmez
+                    os.posix_fallocate(f.fileno(), 0, size)
+                shutil.copyfileobj(r.raw, f, length=COPY_BUFSIZE)
+        return dest
+
+    def _dest_for(self, basename: str, key: str, ts: str) -> pathlib.Path:
+        """Deterministic local name for one final."""
+        return self.output_dir / f"{basename}__{key}__{ts}{_EXT_BY_FORMAT[self.output_format]}"
 
 
 # ------------------- CLI -------------------
@@ -405,14 +799,18 @@ def main() -> None:
     CLI usage:
       python -m TheProd.PicPre                      -> process latest image (default ratios & quantity)
       python -m TheProd.PicPre /path/to.jpg         -> process the given image
+      python -m TheProd.PicPre --batch [limit]      -> process all new images in images_dir
     """
     pp = PicPre()
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        limit = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        result = pp.run_batch(limit=limit)
+    elif len(sys.argv) > 1:
         result = pp.run_for_image(sys.argv[1])
     else:
         result = pp.run()
     print("\n✅ Tamamlandı.\n")
-    print(json.dumps(result, indent=2, ensure_ascii=False))
+    print(_dumps(result))
 
 
 if __name__ == "__main__":
@@ -2,12 +2,20 @@
 from __future__ import annotations
 
 import json
+import os
 import shutil
 import pathlib
+import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Literal, Optional, Union
+
+try:  # opsiyonel: orjson varsa serialize çok daha hızlı (doğrudan bytes döner)
+    import orjson
+except ImportError:
+    orjson = None
 
 # --- Proje kökünü (THE E/) sys.path'e ekle ---
 ROOT = pathlib.Path(__file__).resolve().parents[1]
@@ -22,11 +30,81 @@ from TheProd.PicPre import PicPre, ALLOWED_RATIOS
 from TheProd.DescMaker import DescMaker
 
 
+# izin verilmeyen her karakter (boşluk ve ASCII dışı dahil) → "-"; tek C geçişi
+_SLUG_RE = re.compile(r"[^A-Za-z0-9._-]")
+
+
 def _slugify(name: str) -> str:
-    allowed = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-._"
-    base = name.strip().replace(" ", "-")
-    cleaned = "".join(ch if ch in allowed else "-" for ch in base)
-    return cleaned[:120] or "product"
+    return _SLUG_RE.sub("-", name.strip())[:120] or "product"
+
+
+def _json_bytes(obj: Any) -> bytes:
+    """Pretty (indent=2) UTF-8 JSON bytes; tek write_bytes ile yazılır."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def _atomic_write_bytes(path: pathlib.Path, data: bytes) -> None:
+    """tmp + fsync + os.replace: okuyan taraf ya eski ya yeni dosyayı görür, yarım JSON değil."""
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _fast_copy(src: pathlib.Path, dst: pathlib.Path) -> None:
+    """
+    copy2 eşdeğeri. Linux'ta önce os.copy_file_range (kernel içi kopya; XFS/Btrfs'te reflink),
+    olmazsa shutil.copy2 (zaten sendfile/fcopyfile kullanır). Metadata copystat ile korunur.
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, "rb") as fi, open(dst, "wb") as fo:
+                remaining = os.fstat(fi.fileno()).st_size
+                while remaining > 0:
+                    n = os.copy_file_range(fi.fileno(), fo.fileno(), remaining)
+                    if n == 0:
+                        break
+                    remaining -= n
+            if remaining == 0:
+                shutil.copystat(src, dst)
+                return
+        except OSError:
+            pass  # ENOSYS/EXDEV/EINVAL vb. → klasik yol
+    shutil.copy2(src, dst)
+
+
+def _same_file(a: pathlib.Path, b: pathlib.Path) -> bool:
+    """Aynı inode mu (st_dev + st_ino); farklı yazılmış yollar/harf büyüklüğü gereksiz kopyaya yol açmaz."""
+    try:
+        return a.samefile(b)
+    except OSError:  # dst henüz yok
+        return False
+
+
+LinkMode = Literal["copy", "hardlink", "move"]
+
+
+def _place(src: pathlib.Path, dst: pathlib.Path, mode: LinkMode) -> None:
+    """
+    Dosyayı dst'ye yerleştirir:
+      - hardlink: aynı dosya sisteminde veri taşımadan os.link (EXDEV/EEXIST vb. → kopya)
+      - move:     os.replace/shutil.move (yalnızca bize ait ara dosyalar için)
+      - copy:     _fast_copy
+    """
+    if mode == "move":
+        shutil.move(str(src), str(dst))
+        return
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    _fast_copy(src, dst)
 
 
 @dataclass
@@ -50,6 +128,22 @@ class ProductBuilder:
     def __init__(self, products_dir: pathlib.Path = PRODUCTS_DIR) -> None:
         self.products_dir = pathlib.Path(products_dir)
         self.products_dir.mkdir(parents=True, exist_ok=True)
+        # İlk kullanımda kurulur, sonraki build()'lerde tekrar kullanılır
+        # (Vertex AI / boto3 / Claid oturumları yeniden açılmaz; ikisi de thread'ler arası paylaşılabilir)
+        self._desc: Optional[DescMaker] = None
+        self._pic: Optional[PicPre] = None
+
+    @property
+    def desc_maker(self) -> DescMaker:
+        if self._desc is None:
+            self._desc = DescMaker()
+        return self._desc
+
+    @property
+    def pic(self) -> PicPre:
+        if self._pic is None:
+            self._pic = PicPre()
+        return self._pic
 
     def build(
         self,
@@ -59,7 +153,15 @@ class ProductBuilder:
         ratios: Optional[List[str]] = None,
         hints: Optional[str] = None,
         provider_link: Optional[str] = None,
+        max_workers: int = 4,
+        link_mode: LinkMode = "hardlink",
     ) -> BuiltProduct:
+        """
+        link_mode: ürün klasörüne dosyaların nasıl konacağı.
+          yalnızca üretilen sahneler için geçerli: "hardlink" (varsayılan) aynı diskteyse veri kopyalamaz;
+          "move" sahneleri output/ klasöründen taşır; "copy" her zaman kopyalar.
+          Kaynak görseller her zaman kopyalanır (bkz. aşağıda).
+        """
         if not image_paths:
             raise ValueError("En az bir görsel gerekli.")
         if ratios:
@@ -67,30 +169,12 @@ class ProductBuilder:
                 if r not in ALLOWED_RATIOS:
                     raise ValueError(f"Geçersiz aspect ratio: {r}")
 
-        # 1) Title + Description
-        desc = DescMaker().generate_for_images(image_paths, hints=hints)
-        title = desc.title.strip()
-        description = desc.description.strip()
-
-        # 2) Ürün klasör yapısı
-        ts = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
-        folder_name = f"{_slugify(title)}__{ts}"
-        product_dir = self.products_dir / folder_name
-        src_dir = product_dir / "images" / "source"
-        gen_dir = product_dir / "images" / "generated"
-        src_dir.mkdir(parents=True, exist_ok=True)
-        gen_dir.mkdir(parents=True, exist_ok=True)
-
-        # Orijinalleri ürün klasörüne kopyala
-        normalized_sources: List[str] = []
+        sources: List[pathlib.Path] = []
         for p in image_paths:
             pth = pathlib.Path(p).expanduser().resolve()
             if not pth.exists():
                 raise FileNotFoundError(f"Görsel bulunamadı: {pth}")
-            dst = src_dir / pth.name
-            if pth != dst:
-                shutil.copy2(pth, dst)
-            normalized_sources.append(str(dst))
+            sources.append(pth)
 
         # qty sözlüğünden bu görsel için değer çek
         def _qty_for(img_path: str) -> int:
@@ -103,19 +187,56 @@ class ProductBuilder:
                 return max(1, min(5, int(qty[bname])))
             return 2
 
-        # 3) PicPre ile sahne üret
-        pic = PicPre()
-        generated_paths: List[str] = []
-        for p in normalized_sources:
-            this_qty = _qty_for(p)
-            res = pic.run_auto(p, quantity=int(this_qty), ratios=ratios if ratios else None)
-            for local_path in res.get("saved_files", {}).values():
-                lp = pathlib.Path(local_path)
-                if lp.exists():
-                    dst = gen_dir / lp.name
-                    if lp != dst:
-                        shutil.copy2(lp, dst)
-                    generated_paths.append(str(dst))
+        # 1) Title + Description ve 2) PicPre sahneleri birbirinden bağımsız → aynı anda başlar.
+        #    Sahneler kaynak görsellerden üretilir (ürün klasörü başlığa bağlı, başlık DescMaker'dan gelir);
+        #    aynı PicPre: Claid çağrıları onun semaphore'u ile sınırlı kalır.
+        pic = self.pic
+        workers = max(1, min(max_workers, len(sources)))
+        with ThreadPoolExecutor(max_workers=workers + 1) as ex:
+            desc_future = ex.submit(self.desc_maker.generate_for_images, image_paths, hints=hints)
+            pic_futures = [
+                ex.submit(pic.run_auto, str(pth), quantity=_qty_for(str(pth)), ratios=ratios if ratios else None)
+                for pth in sources
+            ]
+            try:
+                desc = desc_future.result()
+            except BaseException:
+                for f in pic_futures:
+                    f.cancel()
+                raise
+            title = desc.title.strip()
+            description = desc.description.strip()
+
+            # Ürün klasör yapısı (sahneler arka planda sürerken)
+            ts = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+            folder_name = f"{_slugify(title)}__{ts}"
+            product_dir = self.products_dir / folder_name
+            src_dir = product_dir / "images" / "source"
+            gen_dir = product_dir / "images" / "generated"
+            src_dir.mkdir(parents=True, exist_ok=True)
+            gen_dir.mkdir(parents=True, exist_ok=True)
+
+            # Orijinaller her zaman kopyalanır (copy_file_range; destekleyen FS'te reflink):
+            # dosya bize ait değil — hardlink olsaydı kaynak yerinde düzenlenince/üzerine
+            # yazılınca (ör. aynı adlı yeni upload) ürünün source görseli de değişirdi
+            pairs = [(pth, src_dir / pth.name) for pth in sources]
+            normalized_sources: List[str] = [str(dst) for _, dst in pairs]
+            src_mode: LinkMode = "copy"
+            copy_jobs = [(pth, dst) for pth, dst in pairs if not _same_file(pth, dst)]
+            if copy_jobs:
+                with ThreadPoolExecutor(max_workers=max(1, min(8, len(copy_jobs)))) as cx:
+                    list(cx.map(lambda sd: _place(*sd, src_mode), copy_jobs))
+
+            # Üretilenleri giriş sırasıyla topla
+            generated_paths: List[str] = []
+            for f in pic_futures:
+                for local_path in f.result().get("saved_files", {}).values():
+                    lp = pathlib.Path(local_path)
+                    if lp.exists():
+                        dst = gen_dir / lp.name
+                        if not _same_file(lp, dst):
+                            _place(lp, dst, link_mode)
+                        generated_paths.append(str(dst))
 
         # 4) Metadata
         meta = {
@@ -135,7 +256,7 @@ class ProductBuilder:
             "shared": False,
         }
         meta_path = product_dir / "product.json"
-        meta_path.write_text(json.dumps(meta, indent=2, ensure_ascii=False), encoding="utf-8")
+        _atomic_write_bytes(meta_path, _json_bytes(meta))
 
         return BuiltProduct(
             title=title,
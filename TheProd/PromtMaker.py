@@ -1,17 +1,28 @@
 # TheProd/PromtMaker.py
 from __future__ import annotations
 
+import hashlib
 import json
 import os
 import pathlib
 import re
-import mimetypes
 from dataclasses import dataclass
-from typing import Any, Dict, Optional
+from functools import lru_cache
+from io import BytesIO
+from typing import Any, BinaryIO, Dict, Optional, Tuple, Union
+
+from PIL import Image
 
 from google.cloud import aiplatform
 from vertexai.generative_models import GenerativeModel, Part, SafetySetting, HarmCategory
 
+try:  # opsiyonel: orjson varsa JSON parse çok daha hızlı
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    _json_loads = json.loads
+
 # ---- SABİTLER (senin GCP projen) ----
 # GCP Console ekranındaki Project ID:
 GCP_PROJECT_ID = "melodic-splicer-449022-g3"
@@ -19,6 +30,13 @@ GCP_PROJECT_ID = "melodic-splicer-449022-g3"
 GCP_VERTEX_REGION = "us-central1"
 # İsteğe bağlı: modeli de sabitleyebiliriz
 GEMINI_MODEL_NAME = "gemini-2.0-flash"
+# Opsiyonel cevap önbelleği (use_cache=True; aynı görsel + aynı ayarlar → Gemini'ye tekrar gitme).
+# PicPre kendi prompt cache'ini (THEE_PROMPT_CACHE) kullanır, bunu açmaz.
+CACHE_DIR = pathlib.Path(os.getenv("THEE_PROMTMAKER_CACHE", "~/.cache/promtmaker")).expanduser()
+# Pratikte yalnızca bu uzantılar geliyor; mimetypes'ın /etc/mime.types taramasına gerek yok
+_EXT2MIME = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}
+# Gemini görseli zaten ~768px'e indiriyor; daha büyüğünü göndermek boşa upload + token
+MAX_SIDE = int(os.getenv("THEE_PROMTMAKER_MAX_SIDE", "1024"))
 
 
 def _ensure_env_vars() -> None:
@@ -31,6 +49,136 @@ def _ensure_env_vars() -> None:
     os.environ.setdefault("VERTEXAI_REGION", GCP_VERTEX_REGION)
 
 
+# Safety ayarları sabit; tüm PromtMaker örnekleri aynı listeyi paylaşır
+_SAFETY = [
+    SafetySetting(
+        category=HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+    ),
+    SafetySetting(
+        category=HarmCategory.HARM_CATEGORY_HARASSMENT,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+    ),
+    SafetySetting(
+        category=HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+    ),
+    SafetySetting(
+        category=HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+    ),
+]
+
+
+# Model cevabındaki ```json ... ``` çitleri
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE | re.MULTILINE)
+
+
+def _sniff_mime(data: bytes) -> str:
+    """Bellekteki görselin türü (dosya adı yoksa imzadan); bilinmiyorsa image/jpeg."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def _maybe_downscale(img_bytes: bytes, mime: str) -> Tuple[bytes, str]:
+    """Uzun kenarı MAX_SIDE'ı aşan görseli küçültür (JPEG q85; alfa varsa PNG). Küçükse aynen döner."""
+    try:
+        with Image.open(BytesIO(img_bytes)) as im:
+            if max(im.size) <= MAX_SIDE:
+                return img_bytes, mime
+            im.draft("RGB", (MAX_SIDE, MAX_SIDE))  # JPEG: DCT ölçekli decode, tam çözünürlük açılmaz
+            im.thumbnail((MAX_SIDE, MAX_SIDE), Image.Resampling.LANCZOS)
+            out = BytesIO()
+            if im.mode in ("RGBA", "LA") or "transparency" in im.info:
+                im.save(out, format="PNG", optimize=False)
+                return out.getvalue(), "image/png"
+            im.convert("RGB").save(out, format="JPEG", quality=85)
+            return out.getvalue(), "image/jpeg"
+    except Exception:
+        return img_bytes, mime
+
+
+def _first_json_object(text: str) -> Optional[str]:
+    """İlk dengeli {...} bloğunu tek geçişte bulur (string içindeki parantezleri sayma)."""
+    start = text.find("{")
+    if start < 0:
+        return None
+    depth = 0
+    in_str = esc = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
+# --- Sabit prompt parçaları ---
+# Her çağrıda aynı byte'lar, aynı sırada ve en başta gider; Gemini'nin implicit
+# prefix cache'i bu ortak öneki yeniden kullanabilir. Çağrıya özel her şey en sonda.
+# JSON biçimi response_schema ile zorlanıyor; burada yalnızca alanların içeriği tarif edilir
+_SYSTEM = (
+    "You are an e‑commerce visual prompt engineer writing for a background generation API (Claid addBackground).\n"
+    "- subject: concise item name (e.g., 'matte black wireless earbuds').\n"
+    "- claid_prompt: ONE cohesive scene of the requested length: environment, surface under the product, "
+    "lighting & shadows, depth of field, palette, overall style. Truthful to the image; no brands, logos, text "
+    "or watermarks; no clutter or extreme props; SFW.\n"
+    "- product_summary: 1–2 sentences on item/material/color."
+)
+# JSON çıktısını model tarafında zorla (çit/ek metin yok, ayrıştırma tek json.loads)
+_RESPONSE_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "subject": {"type": "string"},
+        "claid_prompt": {"type": "string"},
+        "product_summary": {"type": "string"},
+    },
+    "required": ["subject", "claid_prompt", "product_summary"],
+}
+_USER_TASK = (
+    "Analyze the product and compose the JSON. "
+    "For claid_prompt, write a single paragraph that reads like a creative art director note. "
+    "Lead with the scene (space/ambience), then the surface, then lighting & shadows, then palette and finishing touches. "
+    "Prefer natural language over technical terms. Be specific about textures (e.g., travertine, light oak, linen, matte ceramic) and light quality (soft daylight, window side‑light, gentle falloff). "
+    "Keep it tasteful and production‑ready."
+)
+# generation_config'in çağrıdan bağımsız kısmı (temperature / max_output_tokens çağrıya özel)
+_GEN_BASE: Dict[str, Any] = {
+    "top_p": 0.9,
+    "top_k": 40,
+    "response_mime_type": "application/json",
+    "response_schema": _RESPONSE_SCHEMA,
+}
+# Sabit prompt parçalarının + üretim ayarlarının + downscale sınırının parmak izi; metin/şema/ayar
+# değişince bu sonuçları saklayan önbellekler (bu sınıfınki, PicPre prompt cache) kendiliğinden geçersiz olur
+PROMPT_FINGERPRINT = hashlib.blake2b(
+    "\x00".join((_SYSTEM, _USER_TASK, json.dumps(_GEN_BASE, sort_keys=True), str(MAX_SIDE))).encode("utf-8"),
+    digest_size=8,
+).hexdigest()
+
+
+@lru_cache(maxsize=8)
+def _get_model(project_id: str, region: str, model_name: str) -> GenerativeModel:
+    """aiplatform.init + GenerativeModel; (project, region, model) başına bir kez yapılır."""
+    aiplatform.init(project=project_id, location=region)
+    return GenerativeModel(model_name)
+
+
 @dataclass
 class PromtResult:
     """Normalized result for downstream usage (e.g., Claid addBackground)."""
@@ -58,6 +206,8 @@ class PromtMaker:
         project_id: Optional[str] = None,
         region: Optional[str] = None,
         model_name: str = GEMINI_MODEL_NAME,
+        cache_dir: Optional[str] = None,
+        use_cache: bool = False,
     ):
         _ensure_env_vars()
 
@@ -67,92 +217,76 @@ class PromtMaker:
 
         self.region = region or os.getenv("VERTEXAI_REGION") or GCP_VERTEX_REGION
 
-        # Vertex AI init
-        aiplatform.init(project=self.project_id, location=self.region)
-        self.model = GenerativeModel(model_name)
+        # Vertex AI init + model (process başına bir kez, önbellekten)
+        self.model_name = model_name
+        self.model = _get_model(self.project_id, self.region, model_name)
+
+        # disk önbelleği (varsayılan kapalı): <cache_dir>/<blake2b>.json
+        self._cache_dir = pathlib.Path(cache_dir).expanduser() if cache_dir else CACHE_DIR
+        self.use_cache = use_cache
 
         # Reasonable safety settings
-        self.safety = [
-            SafetySetting(
-                category=HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            ),
-            SafetySetting(
-                category=HarmCategory.HARM_CATEGORY_HARASSMENT,
-                threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            ),
-            SafetySetting(
-                category=HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            ),
-            SafetySetting(
-                category=HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            ),
-        ]
+        self.safety = _SAFETY
 
     # ------------------------ Public API ------------------------
 
     def analyze_and_prompt(
         self,
-        image_path: str,
+        image: Union[str, pathlib.Path, bytes, BinaryIO],
         *,
+        mime_type: Optional[str] = None,
         temperature: float = 0.7,
         style_hint: Optional[str] = None,
         prompt_words: int = 60,
     ) -> PromtResult:
         """
         Analyze the image and craft a Claid-ready background prompt.
+        `image` is a path, raw bytes or a binary file object (in-memory images skip the disk);
+        `mime_type` overrides the type guessed from the extension / file signature.
         `temperature` controls creativity; `style_hint` nudges stylistic choices.
         `prompt_words` targets the length of the background description (default ~60 words).
         """
-        img_path = pathlib.Path(image_path).expanduser()
-        if not img_path.exists():
-            raise FileNotFoundError(f"Image not found: {img_path}")
-
-        mime, _ = mimetypes.guess_type(str(img_path))
-        if not mime:
-            mime = "image/jpeg"
-
-        img_part = Part.from_data(mime_type=mime, data=img_path.read_bytes())
-
-        system = (
-            "You are an expert e‑commerce visual prompt engineer. "
-            "You receive a product image and must output a STRICT JSON object tailored for a background generation API (e.g., Claid addBackground). "
-            "Fields: \n"
-            "1) subject: concise item name (e.g., 'matte black wireless earbuds').\n"
-            "2) claid_prompt: ONE vivid, cohesive scene description of ~" + str(prompt_words) + " words (±15). "
-            "   Describe: environment/context, surface/material under the product, lighting mood & direction, shadows/reflections, depth of field, color palette/harmony, and overall style (studio/editorial/lifestyle). "
-            "   Be imaginative but truthful to the image; no brand names or logos; no camera jargon unless clearly implied; SFW. Avoid clutter, busy patterns, extreme props, text overlays, or watermark‑like elements.\n"
-            "3) product_summary: 1–2 concise sentences summarizing item/material/color.\n"
-            "Output MUST be pure JSON (no markdown fences, no extra prose)."
-        )
-
-        user_task = (
-            "Analyze the product and compose the JSON. "
-            "For claid_prompt, write a single paragraph that reads like a creative art director note. "
-            "Lead with the scene (space/ambience), then the surface, then lighting & shadows, then palette and finishing touches. "
-            "Prefer natural language over technical terms. Be specific about textures (e.g., travertine, light oak, linen, matte ceramic) and light quality (soft daylight, window side‑light, gentle falloff). "
-            "Keep it tasteful and production‑ready."
-        )
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            img_bytes = bytes(image)
+            mime = mime_type or _sniff_mime(img_bytes)
+        elif hasattr(image, "read"):
+            img_bytes = image.read()
+            mime = mime_type or _sniff_mime(img_bytes)
+        else:
+            img_path = pathlib.Path(image).expanduser()
+            if not img_path.exists():
+                raise FileNotFoundError(f"Image not found: {img_path}")
+            img_bytes = img_path.read_bytes()
+            mime = mime_type or _EXT2MIME.get(img_path.suffix.lower(), "image/jpeg")
+
+        # Değişen kısımlar (stil + uzunluk) en sona: sabit önek her çağrıda birebir aynı kalır
+        per_call = "Compose claid_prompt around " + str(prompt_words) + " words (±15)."
         if style_hint:
-            user_task += " Strong style preference: " + style_hint.strip()
-        user_task += " Compose around " + str(prompt_words) + " words."
+            per_call = "Strong style preference: " + style_hint.strip() + ". " + per_call
+        gen_cfg = {
+            **_GEN_BASE,
+            "temperature": float(temperature),
+            # ~1.3 token/kelime + subject/summary/JSON payı; tavan düşük → daha kısa üretim
+            "max_output_tokens": int(prompt_words * 2) + 120,
+        }
+
+        cache_key = self._cache_key(img_bytes, per_call, gen_cfg)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+        send_bytes, send_mime = _maybe_downscale(img_bytes, mime)
+        img_part = Part.from_data(mime_type=send_mime, data=send_bytes)
 
         resp = self.model.generate_content(
             [
-                system,
+                _SYSTEM,
+                _USER_TASK,
                 img_part,
-                user_task,
-                'Return JSON like: {"subject":"...", "claid_prompt":"...", "product_summary":"..."}',
+                per_call,
             ],
             safety_settings=self.safety,
-            generation_config={
-                "temperature": float(temperature),
-                "top_p": 0.9,
-                "top_k": 40,
-                "max_output_tokens": 512,
-            },
+            generation_config=gen_cfg,
         )
 
         raw = (resp.text or "").strip()
@@ -170,27 +304,70 @@ class PromtMaker:
                 f"subtle reflection; cohesive neutral palette with one warm accent; uncluttered, premium, photorealistic"
             )
 
-        return PromtResult(
+        result = PromtResult(
             subject=subject,
             claid_prompt=claid_prompt,
             product_summary=product_summary,
             raw_text=raw,
         )
+        self._cache_put(cache_key, result)
+        return result
 
     # ------------------------ Utils ------------------------
 
+    def _cache_key(self, img_bytes: bytes, per_call: str, gen_cfg: Dict[str, Any]) -> str:
+        """Görsel + model + gönderilen tüm metin (sabit önek parmak izi + çağrıya özel kısım) + generation_config."""
+        h = hashlib.blake2b(img_bytes, digest_size=16)
+        h.update(f"|{self.model_name}|{PROMPT_FINGERPRINT}|{per_call}|".encode("utf-8"))
+        h.update(json.dumps(gen_cfg, sort_keys=True).encode("utf-8"))
+        return h.hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[PromtResult]:
+        if not self.use_cache:
+            return None
+        path = self._cache_dir / f"{key}.json"
+        try:
+            data = _json_loads(path.read_bytes())
+            return PromtResult(
+                subject=data["subject"],
+                claid_prompt=data["claid_prompt"],
+                product_summary=data["product_summary"],
+                raw_text=data.get("raw_text", ""),
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _cache_put(self, key: str, result: PromtResult) -> None:
+        """Atomik yazım (tmp + os.replace); paralel çağrılar yarım dosya görmez."""
+        if not self.use_cache:
+            return
+        path = self._cache_dir / f"{key}.json"
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{id(result)}.tmp")
+        try:
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps({
+                "subject": result.subject,
+                "claid_prompt": result.claid_prompt,
+                "product_summary": result.product_summary,
+                "raw_text": result.raw_text,
+            }, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️ PromtMaker cache write failed: {e}")
+            tmp.unlink(missing_ok=True)
+
     def _extract_json(self, text: str) -> Dict[str, Any]:
         """Extract a JSON object from model text, stripping optional code fences."""
-        cleaned = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip(), flags=re.IGNORECASE | re.MULTILINE)
+        cleaned = _FENCE_RE.sub("", text.strip())
         try:
-            return json.loads(cleaned)
-        except Exception:
-            m = re.search(r"\{.*\}", cleaned, flags=re.DOTALL)
-            if not m:
+            return _json_loads(cleaned)
+        except ValueError:
+            block = _first_json_object(cleaned)
+            if not block:
                 return {}
             try:
-                return json.loads(m.group(0))
-            except Exception:
+                return _json_loads(block)
+            except ValueError:
                 return {}
 
 
@@ -1,59 +1,197 @@
 # UI/app.py
+import io
+import os
+import re
 import sys
 import json
 import pathlib
 import tempfile
-from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 import streamlit as st
+from PIL import Image
+
+try:  # opsiyonel: orjson varsa parse/serialize çok daha hızlı (doğrudan bytes, ara str yok)
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    _json_loads = json.loads
 
 # --- Proje kökünü (THE E/) sys.path'e ekle ---
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from TheProd.ProductBuilder import ProductBuilder
+from TheProd.ProductBuilder import ProductBuilder, _place, _same_file
 from TheProd.PicPre import ALLOWED_RATIOS, PicPre
 
 PRODUCTS_DIR = ROOT / "Products"
+# str.endswith(tuple): tek C çağrısı; Path.suffix + set literal kurmaya gerek yok
+_IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp")
 
 # ============== yardımcılar ==============
 def _read_json(path: pathlib.Path) -> dict:
     try:
-        return json.loads(path.read_text(encoding="utf-8"))
+        return _json_loads(path.read_bytes())
     except Exception:
         return {}
 
 def _write_json(path: pathlib.Path, data: dict) -> None:
-    path.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        return
+    with open(path, "w", encoding="utf-8", buffering=1 << 20) as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
 
-def _product_dirs() -> List[pathlib.Path]:
-    if not PRODUCTS_DIR.exists():
+# Liste yalnızca title/shared kullanıyor; açıklama ve görsel listeleri parse edilmez
+_TITLE_RE = re.compile(rb'"title"\s*:\s*("(?:[^"\\]|\\.)*")')
+_SHARED_RE = re.compile(rb'"shared"\s*:\s*(true|false)')
+
+def _read_product_summary(path: pathlib.Path) -> dict:
+    """{title, shared} from product.json without building the full document; regex miss → full parse."""
+    try:
+        data = path.read_bytes()
+    except OSError:
+        return {}
+    t = _TITLE_RE.search(data)
+    sh = _SHARED_RE.search(data)
+    if t and sh:
+        try:
+            return {"title": _json_loads(t.group(1)), "shared": sh.group(1) == b"true"}
+        except ValueError:
+            pass
+    try:
+        meta = _json_loads(data)
+    except ValueError:
+        return {}
+    return {"title": meta.get("title"), "shared": meta.get("shared", False)}
+
+# Streamlit her widget etkileşiminde script'i baştan çalıştırır; aşağıdaki okumalar
+# mtime anahtarıyla önbellekte tutulur → dosya/klasör değişmedikçe tekrar okunmaz/parse edilmez.
+def _dir_mtime(d: pathlib.Path) -> float:
+    try:
+        return d.stat().st_mtime
+    except OSError:
+        return 0.0
+
+def _image_entries(d: str) -> List[Tuple[float, str]]:
+    """(mtime, path) for images directly in `d`; missing folder → []."""
+    try:
+        with os.scandir(d) as it:
+            return [
+                (e.stat().st_mtime, e.path) for e in it
+                if e.name.lower().endswith(_IMAGE_EXTS)
+            ]
+    except OSError:
         return []
-    dirs = []
-    for p in sorted(PRODUCTS_DIR.iterdir(), key=lambda x: x.stat().st_mtime, reverse=True):
-        if p.is_dir() and (p / "product.json").exists():
-            dirs.append(p)
-    return dirs
+
+@st.cache_data(show_spinner=False)
+def _cover_image_cached(pdir_str: str, gen_mtime: float, src_mtime: float) -> Optional[str]:
+    for sub in ("generated", "source"):
+        imgs = _image_entries(os.path.join(pdir_str, "images", sub))
+        if imgs:
+            return max(imgs)[1]  # en yeni
+    return None
 
 def _cover_image(pdir: pathlib.Path) -> Optional[str]:
-    gen_dir = pdir / "images" / "generated"
-    src_dir = pdir / "images" / "source"
-    def first_img(d: pathlib.Path) -> Optional[str]:
-        if d.exists():
-            imgs = [x for x in d.iterdir() if x.suffix.lower() in {".png",".jpg",".jpeg",".webp"}]
-            if imgs:
-                imgs.sort(key=lambda x: x.stat().st_mtime, reverse=True)
-                return str(imgs[0])
-        return None
-    return first_img(gen_dir) or first_img(src_dir)
+    # klasöre dosya eklenince/silinince mtime değişir → önbellek kendiliğinden geçersizleşir
+    return _cover_image_cached(
+        str(pdir),
+        _dir_mtime(pdir / "images" / "generated"),
+        _dir_mtime(pdir / "images" / "source"),
+    )
+
+@st.cache_data(show_spinner=False)
+def _all_images_cached(pdir_str: str, gen_mtime: float, src_mtime: float) -> List[str]:
+    # mtime tarama sırasında bir kez alınır; sıralamada yeniden stat yok
+    pairs: List[Tuple[float, str]] = []
+    for sub in ("generated", "source"):
+        pairs += _image_entries(os.path.join(pdir_str, "images", sub))
+    pairs.sort(key=lambda r: r[0], reverse=True)
+    return [path for _, path in pairs]
 
 def _all_images(pdir: pathlib.Path) -> List[str]:
-    out = []
-    for sub in ["generated", "source"]:
-        d = pdir / "images" / sub
-        if d.exists():
-            out += [str(x) for x in d.iterdir() if x.suffix.lower() in {".png",".jpg",".jpeg",".webp"}]
-    return sorted(out, key=lambda p: pathlib.Path(p).stat().st_mtime, reverse=True)
+    return _all_images_cached(
+        str(pdir),
+        _dir_mtime(pdir / "images" / "generated"),
+        _dir_mtime(pdir / "images" / "source"),
+    )
+
+_SHARED_BADGE = (
+    "  <span style='background:#10b981;color:white;border-radius:6px;"
+    "padding:2px 6px;font-size:0.75rem;margin-left:8px;'>Shared</span>"
+)
+
+@st.cache_data(show_spinner=False)
+def _product_row(pdir_str: str, meta_mtime: float, gen_mtime: float, src_mtime: float) -> dict:
+    """Liste için gereken her şey tek satırda; product.json/görsel klasörleri değişince yeniden kurulur."""
+    meta = _read_product_summary(pathlib.Path(pdir_str) / "product.json")
+    name = os.path.basename(pdir_str)
+    title = meta.get("title") or name
+    shared = bool(meta.get("shared", False))
+    return {
+        "path": pdir_str,
+        "name": name,
+        "title": title,
+        "shared": shared,
+        "cover": _cover_image_cached(pdir_str, gen_mtime, src_mtime),
+        # arama ve render için hazır alanlar (her tuş vuruşunda yeniden hesaplanmaz)
+        "title_lc": title.lower(),
+        "name_lc": name.lower(),
+        "label": f"**{title}**{_SHARED_BADGE if shared else ''}",
+        "view_key": f"view_{name}",
+    }
+
+def _scan_products() -> List[dict]:
+    """
+    Products klasöründe tek geçiş: her ürün için {path, name, title, cover, mtime, shared}.
+    Arama ve liste aynı satırları kullanır (ek dosya okuması yok); yeniden eskiye sıralı.
+    """
+    if not PRODUCTS_DIR.exists():
+        return []
+    rows = []
+    # scandir: is_dir/stat DirEntry üzerinden, Path nesnesi yok
+    with os.scandir(PRODUCTS_DIR) as it:
+        for e in it:
+            if not e.is_dir(follow_symlinks=False):
+                continue
+            try:
+                meta_mtime = os.stat(os.path.join(e.path, "product.json")).st_mtime
+            except OSError:
+                continue
+            img_root = os.path.join(e.path, "images")
+            row = dict(_product_row(
+                e.path,
+                meta_mtime,
+                _dir_mtime(pathlib.Path(img_root, "generated")),
+                _dir_mtime(pathlib.Path(img_root, "source")),
+            ))
+            row["mtime"] = e.stat().st_mtime
+            rows.append(row)
+    rows.sort(key=lambda r: r["mtime"], reverse=True)
+    return rows
+
+@st.cache_data(show_spinner=False, max_entries=2048)
+def _thumb_cached(path: str, mtime: float, max_side: int) -> bytes:
+    with Image.open(path) as im:
+        im.draft("RGB", (max_side, max_side))  # JPEG: küçültülmüş decode
+        im.thumbnail((max_side, max_side))
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+        buf = io.BytesIO()
+        im.save(buf, "WEBP", quality=80, method=4)
+        return buf.getvalue()
+
+def _thumb(path: str, max_side: int = 256):
+    """
+    Izgara/kapak için küçük WebP (bir kez üretilir, mtime ile önbellekte).
+    Tam çözünürlüklü dosyayı her rerun'da tarayıcıya göndermekten çok daha hafif.
+    """
+    try:
+        return _thumb_cached(path, os.path.getmtime(path), max_side)
+    except Exception:
+        return path  # okunamazsa st.image dosyanın kendisini denesin
 
 def _append_generated_to_meta(product_dir: pathlib.Path, new_paths: List[str]) -> None:
     meta_path = product_dir / "product.json"
@@ -74,7 +212,7 @@ def _image_grid(paths: List[str], cols: int = 6, limit: int = 24) -> None:
         c = st.columns(len(row))
         for j, p in enumerate(row):
             with c[j]:
-                st.image(p, use_container_width=True)
+                st.image(_thumb(p), use_container_width=True)
 
 # ============== UI ==============
 st.set_page_config(page_title="The E • Products", page_icon="📦", layout="wide")
@@ -94,35 +232,22 @@ with tabs[0]:
 
     # --- Liste görünümü ---
     if not selected:
-        pdirs = _product_dirs()
+        rows = _scan_products()
         if q:
-            pdirs = [
-                p for p in pdirs
-                if q in (_read_json(p / "product.json").get("title","") or "").lower()
-                or q in p.name.lower()
-            ]
+            rows = [r for r in rows if q in r["title_lc"] or q in r["name_lc"]]
 
-        if not pdirs:
+        if not rows:
             st.info("Kriterine uyan ürün klasörü bulunamadı.")
         else:
-            for p in pdirs:
-                meta = _read_json(p / "product.json")
-                title = meta.get("title") or p.name
-                cov = _cover_image(p)
-                is_shared = bool(meta.get("shared", False))
-
+            for r in rows:
                 with st.container(border=True):
                     cols = st.columns([1, 3, 1])
-                    if cov:
-                        cols[0].image(cov, use_container_width=True)
+                    if r["cover"]:
+                        cols[0].image(_thumb(r["cover"]), use_container_width=True)
                     # başlık + rozet
-                    badge = (
-                        "  <span style='background:#10b981;color:white;border-radius:6px;"
-                        "padding:2px 6px;font-size:0.75rem;margin-left:8px;'>Shared</span>"
-                    ) if is_shared else ""
-                    cols[1].markdown(f"**{title}**{badge}", unsafe_allow_html=True)
-                    if cols[2].button("View", key=f"view_{p.name}"):
-                        st.session_state.selected_product = str(p)
+                    cols[1].markdown(r["label"], unsafe_allow_html=True)
+                    if cols[2].button("View", key=r["view_key"]):
+                        st.session_state.selected_product = r["path"]
                         st.rerun()
 
     # --- Detay görünümü ---
@@ -185,7 +310,7 @@ with tabs[0]:
             src_dir = sel / "images" / "source"
             src_options = []
             if src_dir.exists():
-                src_options = [x for x in src_dir.iterdir() if x.suffix.lower() in {".png",".jpg",".jpeg",".webp"}]
+                src_options = [x for x in src_dir.iterdir() if x.name.lower().endswith(_IMAGE_EXTS)]
 
             if not src_options:
                 st.caption("Kaynak (source) görsel bulunamadı.")
@@ -204,7 +329,7 @@ with tabs[0]:
                     )
                     with c2:
                         st.caption("Preview")
-                        st.image(str(chosen_src), use_container_width=True)
+                        st.image(_thumb(str(chosen_src)), use_container_width=True)
 
                 with col_b:
                     add_qty = st.number_input("How many?", min_value=1, max_value=5, value=2, step=1)
@@ -215,13 +340,14 @@ with tabs[0]:
                 if st.button("▶️ Generate & append to product"):
                     try:
                         with st.spinner("Yeni sahneler üretiliyor…"):
-                            # PicPre ile üret
+                            # PicPre ile üret; "daha fazla" istendiği için önbellekteki promptlar değil, yenileri
                             res = PicPre().run_auto(
                                 str(chosen_src),
                                 quantity=int(add_qty),
-                                ratios=add_ratios if add_ratios else None
+                                ratios=add_ratios if add_ratios else None,
+                                use_prompt_cache=False,
                             )
-                            # çıktıları ürün klasörüne kopyala
+                            # çıktıları ürün klasörüne yerleştir (aynı diskteyse hardlink, değilse hızlı kopya)
                             gen_dir = sel / "images" / "generated"
                             gen_dir.mkdir(parents=True, exist_ok=True)
                             new_paths = []
@@ -229,9 +355,8 @@ with tabs[0]:
                                 lp = pathlib.Path(local_path)
                                 if lp.exists():
                                     dst = gen_dir / lp.name
-                                    if lp != dst:
-                                        import shutil
-                                        shutil.copy2(lp, dst)
+                                    if not _same_file(lp, dst):
+                                        _place(lp, dst, "hardlink")
                                     new_paths.append(str(dst))
                             if new_paths:
                                 _append_generated_to_meta(sel, new_paths)
@@ -274,15 +399,21 @@ with tabs[1]:
         if not pb_files:
             st.warning("En az 1 görsel seçmelisin.")
         else:
-            import pathlib as _pl
-            tmp_list = []
-            qty_by_path: Dict[str, int] = {}
-            for f in pb_files:
-                p = _pl.Path(tempfile.gettempdir()) / f.name
-                p.write_bytes(f.read())
-                tmp_list.append(str(p))
-                if f.name in per_qty:
-                    qty_by_path[str(p)] = int(per_qty[f.name])
+            # build başına ayrı klasör: aynı adlı uploadlar (IMG_0001.jpg) önceki build'in dosyasının üzerine yazmaz
+            tmp_root = pathlib.Path(tempfile.mkdtemp(prefix="thee-build-"))
+
+            def _spill(f) -> str:
+                # getbuffer: yüklenen byte'ların kopyasız görünümü (read() tüm içeriği kopyalar)
+                p = tmp_root / f.name
+                p.write_bytes(f.getbuffer())
+                return str(p)
+
+            # diske yazmalar paralel (I/O sırasında GIL bırakılır), sıra korunur
+            with ThreadPoolExecutor(max_workers=min(8, len(pb_files))) as ex:
+                tmp_list = list(ex.map(_spill, pb_files))
+            qty_by_path: Dict[str, int] = {
+                p: int(per_qty[f.name]) for f, p in zip(pb_files, tmp_list) if f.name in per_qty
+            }
 
             try:
                 with st.spinner("Ürün klasörü oluşturuluyor…"):